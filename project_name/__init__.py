@@ -1,5 +1,16 @@
-from .app import app
-from .config import settings
-from .db import engine
+from importlib import import_module
 
 __all__ = ["app", "cli", "engine", "settings"]
+
+# Loaded on first access, so importing the package (e.g. to run the CLI)
+# doesn't build the app nor create the database engine.
+LAZY_ATTRIBUTES = {"app": ".app", "engine": ".db", "settings": ".config"}
+
+
+def __getattr__(name: str):
+    if name not in LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(LAZY_ATTRIBUTES[name], __name__), name)
+    # importing `.app` binds the submodule to `app`, the object wins
+    globals()[name] = value
+    return value
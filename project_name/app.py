@@ -2,10 +2,15 @@ import io
 import os
 
 from fastapi import FastAPI
+from sqlalchemy.engine import Engine
 from starlette.middleware.cors import CORSMiddleware
 
+from .compression import CompressionMiddleware
 from .config import settings
-from .db import create_db_and_tables, engine
+from .db import create_db_and_tables, get_engine
+from .metrics import MetricsMiddleware, metrics_endpoint, request_metrics
+from .profiling import ProfilerMiddleware
+from .sqltrace import QueryTraceMiddleware, instrument
 from .routes import main_router
 
 
@@ -49,11 +54,32 @@ if settings.server and settings.server.get("cors_origins", None):
         allow_credentials=settings.get("server.cors_allow_credentials", True),
         allow_methods=settings.get("server.cors_allow_methods", ["*"]),
         allow_headers=settings.get("server.cors_allow_headers", ["*"]),
+        expose_headers=settings.get(
+            "server.cors_expose_headers", ["X-Next-Cursor"]
+        ),
     )
 
+if settings.server and settings.server.get("compression", False):
+    app.add_middleware(CompressionMiddleware)
+
 app.include_router(main_router)
 
+if settings.server and settings.server.get("profiling", False):
+    app.add_middleware(ProfilerMiddleware)
+
+if settings.db.get("trace_queries", False):
+    instrument(Engine)
+    app.add_middleware(QueryTraceMiddleware)
+
+if settings.server and settings.server.get("metrics", False):
+    app.add_middleware(
+        MetricsMiddleware, metrics=request_metrics, router=app.router
+    )
+    app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
+
 
 @app.on_event("startup")
 def on_startup():
-    create_db_and_tables(engine)
+    # with create_on_startup off, run `project_name create-db` on deploy
+    if settings.db.get("create_on_startup", True):
+        create_db_and_tables(get_engine())
@@ -0,0 +1,311 @@
+"""Benchmark of the main API flows, run by `project_name bench`.
+
+Settings are read as the modules are imported and an engine, once
+created, stays bound to its database for the life of the process, so the
+command runs this module in a child process with `PROJECT_NAME_DB__uri`
+pointing to the benchmark SQLite file. The app is driven in process
+through httpx's ASGI transport and over HTTP against a uvicorn server, and the
+throughput and latency percentiles of every flow are printed as JSON.
+"""
+
+import asyncio
+import json
+import math
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Callable, Dict, List
+
+import httpx
+from sqlalchemy import insert
+from sqlmodel import Session, col, select
+
+from .db import create_db_and_tables, get_engine
+from .models.content import Content, ContentTag
+from .security import User, get_password_hash
+
+MODES = ("inprocess", "uvicorn")
+FLOWS = ("login", "list", "get_by_slug", "create", "patch", "profile")
+PASSWORD = "bench"
+
+
+def seed(users: int, contents: int):
+    """Create the `bench<n>` users, all with the same password, and the
+    `bench-content-<n>` contents, those not already in the database."""
+    engine = get_engine()
+    create_db_and_tables(engine)
+    with Session(engine) as session:
+        usernames = [f"bench{number}" for number in range(users)]
+        existing = set(
+            session.exec(
+                select(User.username).where(col(User.username).like("bench%"))
+            ).all()
+        )
+        missing = [name for name in usernames if name not in existing]
+        if missing:
+            # bcrypt is slow on purpose, hash once for every user
+            password = get_password_hash(PASSWORD)
+            session.execute(
+                insert(User),
+                [
+                    {
+                        "username": username,
+                        "password": password,
+                        "superuser": username == "bench0",
+                        "disabled": False,
+                    }
+                    for username in missing
+                ],
+            )
+        user_ids = session.exec(
+            select(User.id).where(col(User.username).like("bench%"))
+        ).all()
+
+        slugs = set(bench_contents(session))
+        numbers = [
+            number
+            for number in range(contents)
+            if f"bench-content-{number}" not in slugs
+        ]
+        if numbers:
+            session.execute(
+                insert(Content),
+                [
+                    {
+                        "title": f"bench content {number}",
+                        "slug": f"bench-content-{number}",
+                        "text": f"Text of the bench content {number}. " * 20,
+                        "published": True,
+                        "created_time": datetime.now().isoformat(),
+                        "legacy_tags": "",
+                        "user_id": user_ids[number % len(user_ids)],
+                    }
+                    for number in numbers
+                ],
+            )
+            session.execute(
+                insert(ContentTag),
+                [
+                    {
+                        "content_id": content_id,
+                        "name": name,
+                        "position": position,
+                    }
+                    for slug, content_id in bench_contents(session).items()
+                    if slug not in slugs
+                    for position, name in enumerate(
+                        ("bench", f"t{content_id % 10}")
+                    )
+                ],
+            )
+        session.commit()
+
+
+def bench_contents(session: Session) -> Dict[str, int]:
+    """The ids of the seeded contents by slug."""
+    rows = session.execute(
+        select(Content.slug, Content.id).where(
+            col(Content.slug).like("bench-content-%")
+        )
+    )
+    return {row.slug: row.id for row in rows}
+
+
+def percentile(latencies: List[float], percent: float) -> float:
+    """Nearest rank percentile of sorted latencies.
+    >>> percentile([1, 2, 3, 4], 50)
+    2
+    """
+    if not latencies:
+        return 0.0
+    rank = max(1, math.ceil(percent / 100 * len(latencies)))
+    return latencies[rank - 1]
+
+
+def milliseconds(seconds: float) -> float:
+    return round(seconds * 1000, 3)
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict:
+    latencies = sorted(latencies)
+    mean = sum(latencies) / len(latencies) if latencies else 0.0
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": round(len(latencies) / elapsed, 2) if elapsed else 0,
+        "mean_ms": milliseconds(mean),
+        "p50_ms": milliseconds(percentile(latencies, 50)),
+        "p95_ms": milliseconds(percentile(latencies, 95)),
+        "p99_ms": milliseconds(percentile(latencies, 99)),
+    }
+
+
+def flow_requests(config: Dict, state: Dict) -> Dict[str, Callable]:
+    """A function sending the request number `n` of each flow."""
+    run = state["run"]
+    headers = {"Authorization": f"Bearer {state['token']}"}
+    content_ids = state["content_ids"]
+    return {
+        "login": lambda client, n: client.post(
+            "/token",
+            data={
+                "username": f"bench{n % config['users']}",
+                "password": PASSWORD,
+            },
+        ),
+        "list": lambda client, n: client.get(
+            "/content/", params={"limit": 50}
+        ),
+        "get_by_slug": lambda client, n: client.get(
+            f"/content/bench-content-{n % config['contents']}/"
+        ),
+        "create": lambda client, n: client.post(
+            "/content/",
+            json={"title": f"bench {run} {n}", "text": "created", "tags": "b"},
+            headers=headers,
+        ),
+        "patch": lambda client, n: client.patch(
+            f"/content/{content_ids[n % len(content_ids)]}/",
+            json={"text": f"patched {run} {n}"},
+            headers=headers,
+        ),
+        "profile": lambda client, n: client.get(
+            "/profile", params={"include_contents": False}, headers=headers
+        ),
+    }
+
+
+async def run_flow(client, send: Callable, requests: int, concurrency: int):
+    latencies: List[float] = []
+    errors = 0
+    numbers = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for number in numbers:
+            start = time.perf_counter()
+            response = await send(client, number)
+            latencies.append(time.perf_counter() - start)
+            errors += response.status_code >= 400
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+async def run_flows(client, config: Dict) -> Dict:
+    response = await client.post(
+        "/token", data={"username": "bench0", "password": PASSWORD}
+    )
+    response.raise_for_status()
+    with Session(get_engine()) as session:
+        content_ids = session.exec(
+            select(Content.id)
+            .where(col(Content.slug).like("bench-content-%"))
+            .limit(100)
+        ).all()
+    state = {
+        "run": f"{time.time():.6f}",
+        "token": response.json()["access_token"],
+        "content_ids": content_ids,
+    }
+    senders = flow_requests(config, state)
+    results = {}
+    for flow in config["flows"]:
+        results[flow] = await run_flow(
+            client, senders[flow], config["requests"], config["concurrency"]
+        )
+    return results
+
+
+async def run_inprocess(config: Dict) -> Dict:
+    from .app import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+        return await run_flows(client, config)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def run_uvicorn(config: Dict) -> Dict:
+    port = free_port()
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "project_name.app:app",
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+        ],
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        async with httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{port}", timeout=60
+        ) as client:
+            for _ in range(100):
+                try:
+                    await client.get("/health")
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.1)
+            return await run_flows(client, config)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+RUNNERS = {"inprocess": run_inprocess, "uvicorn": run_uvicorn}
+
+
+def benchmark(config: Dict) -> Dict:
+    seed(config["users"], config["contents"])
+    return {
+        "config": config,
+        "python": platform.python_version(),
+        "results": {
+            mode: asyncio.run(RUNNERS[mode](config))
+            for mode in config["modes"]
+        },
+    }
+
+
+def run_benchmark(database: str, config: Dict) -> Dict:
+    """Run `benchmark` in a child process bound to `database`."""
+    # the child imports this same package, installed or not
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join(
+            filter(None, [root, os.environ.get("PYTHONPATH")])
+        ),
+        "PROJECT_NAME_DB__uri": f"sqlite:///{os.path.abspath(database)}",
+        "PROJECT_NAME_DB__echo": "false",
+        # the login flow would only measure 429s
+        "PROJECT_NAME_SECURITY__rate_limit": "false",
+    }
+    output = subprocess.run(
+        [sys.executable, "-m", "project_name.bench", json.dumps(config)],
+        env=env,
+        check=True,
+        stdout=subprocess.PIPE,
+    ).stdout
+    return json.loads(output)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    print(json.dumps(benchmark(json.loads(sys.argv[1]))))
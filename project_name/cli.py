@@ -1,12 +1,13 @@
+import json
+import os
+from typing import List, Optional
+
 import typer
-import uvicorn
-from sqlmodel import Session, select
 
-from .app import app
 from .config import settings
-from .db import create_db_and_tables, engine
-from .models.content import Content
-from .security import User
+
+# Commands import what they need when they run, so the CLI starts
+# without building the app nor connecting to the database.
 
 cli = typer.Typer(name="project_name API")
 
@@ -17,20 +18,87 @@ def run(
     host: str = settings.server.host,
     log_level: str = settings.server.log_level,
     reload: bool = settings.server.reload,
-):  # pragma: no cover
-    """Run the API server."""
+    workers: Optional[int] = typer.Option(
+        None,
+        help="Worker processes, 0 for one per CPU [default: server.workers]",
+        show_default=False,
+    ),
+    loop: str = typer.Option(
+        settings.server.get("loop", "auto"), help="auto, asyncio or uvloop."
+    ),
+    http: str = typer.Option(
+        settings.server.get("http", "auto"), help="auto, h11 or httptools."
+    ),
+    backlog: int = settings.server.get("backlog", 2048),
+    keep_alive: int = typer.Option(
+        settings.server.get("keep_alive", 5),
+        help="Seconds to keep idle connections open.",
+    ),
+    max_requests: int = typer.Option(
+        settings.server.get("max_requests", 0),
+        help="Replace a worker after this many requests, 0 for never.",
+    ),
+    max_requests_jitter: int = typer.Option(
+        settings.server.get("max_requests_jitter", 0),
+        help="Random extra requests, so workers aren't replaced together.",
+    ),
+    graceful_timeout: int = typer.Option(
+        settings.server.get("graceful_timeout", 30),
+        help="Seconds given to running requests on shutdown.",
+    ),
+):
+    """Run the API server.
+
+    With several workers, SIGHUP restarts them one after the other and
+    workers that exit, e.g. after --max-requests, are replaced. The
+    database is then created here, before they start.
+    """
+    import uvicorn
+
+    if reload and workers not in (None, 1):
+        typer.echo("--reload runs a single worker", err=True)
+    if workers is None:
+        workers = settings.server.get("workers", 0)
+    # the reloader runs a single process
+    workers = 1 if reload else workers or os.cpu_count() or 1
+    if workers > 1 and settings.db.get("create_on_startup", True):
+        from .db import create_db_and_tables, get_engine
+
+        # workers creating it at once would fail on each other's tables
+        engine = get_engine()
+        create_db_and_tables(engine)
+        engine.dispose()
+        os.environ["PROJECT_NAME_DB__create_on_startup"] = "false"
+    if max_requests and workers == 1:
+        # nothing would start a new process once it exits
+        typer.echo("--max-requests needs several workers, ignored", err=True)
+        max_requests = 0
     uvicorn.run(
         "project_name.app:app",
         host=host,
         port=port,
         log_level=log_level,
         reload=reload,
+        workers=workers,
+        loop=loop,
+        http=http,
+        backlog=backlog,
+        timeout_keep_alive=keep_alive,
+        limit_max_requests=max_requests or None,
+        limit_max_requests_jitter=max_requests_jitter,
+        timeout_graceful_shutdown=graceful_timeout,
     )
 
 
 @cli.command()
 def create_user(username: str, password: str, superuser: bool = False):
     """Create user"""
+    from sqlmodel import Session
+
+    from .db import create_db_and_tables, get_engine
+    from .security import User
+
+    engine = get_engine()
     create_db_and_tables(engine)
     with Session(engine) as session:
         user = User(username=username, password=password, superuser=superuser)
@@ -41,9 +109,148 @@ def create_user(username: str, password: str, superuser: bool = False):
         return user
 
 
+@cli.command("import-users")
+def import_users_command(
+    file: typer.FileText = typer.Argument(
+        ..., help="CSV (with header) or JSON lines file, - for stdin."
+    ),
+    format: Optional[str] = typer.Option(
+        None, help="csv or jsonl, guessed from the file name."
+    ),
+    batch_size: int = typer.Option(500, help="Users inserted per batch."),
+    workers: int = typer.Option(
+        os.cpu_count() or 1, help="Processes hashing passwords."
+    ),
+):
+    """Import users from a file, records need username and password"""
+    from concurrent.futures import ProcessPoolExecutor
+
+    from .db import create_db_and_tables, get_engine
+    from .importer import guess_format, import_users, read_users
+
+    engine = get_engine()
+    create_db_and_tables(engine)
+    records = read_users(file, format or guess_format(file.name))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        report = import_users(
+            engine,
+            records,
+            executor,
+            batch_size=batch_size,
+            on_batch=lambda report: typer.echo(report, err=True),
+            on_duplicate=lambda username: typer.echo(
+                f"skipped duplicate username {username}", err=True
+            ),
+        )
+    typer.echo(f"imported users: {report}")
+
+
+@cli.command()
+def export(
+    kind: str = typer.Argument(..., help="content or users."),
+    output: typer.FileBinaryWrite = typer.Option("-", help="- for stdout."),
+    format: str = typer.Option("ndjson", help="ndjson or json."),
+    batch_size: int = typer.Option(
+        settings.get("export.batch_size", 500), help="Rows read per batch."
+    ),
+):
+    """Stream all the contents or users as NDJSON or a JSON array"""
+    from sqlmodel import Session
+
+    from .db import get_engine
+    from .export import EXPORTS, FORMATS, encode_export, export_batches
+
+    if kind not in EXPORTS:
+        raise typer.BadParameter(f"can't export {kind}")
+    if format not in FORMATS:
+        raise typer.BadParameter(f"unknown format {format}")
+    with Session(get_engine()) as session:
+        for chunk in encode_export(
+            export_batches(session, kind, batch_size), format
+        ):
+            output.write(chunk)
+
+
+@cli.command()
+def bench(
+    users: int = typer.Option(100, help="Users to seed."),
+    contents: int = typer.Option(1000, help="Contents to seed."),
+    requests: int = typer.Option(200, help="Requests per flow."),
+    concurrency: int = typer.Option(10, help="Concurrent clients."),
+    mode: Optional[List[str]] = typer.Option(
+        None, help="inprocess or uvicorn, all by default."
+    ),
+    flow: Optional[List[str]] = typer.Option(
+        None,
+        help="login, list, get_by_slug, create, patch or profile, "
+        "all by default.",
+    ),
+    database: str = typer.Option("bench.db", help="SQLite file to seed."),
+    output: Optional[typer.FileTextWrite] = typer.Option(
+        None, help="Also write the results to this file."
+    ),
+):
+    """Benchmark the main API flows, prints the results as JSON"""
+    from .bench import FLOWS, MODES, run_benchmark
+
+    mode = mode or list(MODES)
+    flow = flow or list(FLOWS)
+    for name, values, allowed in (
+        ("mode", mode, MODES),
+        ("flow", flow, FLOWS),
+    ):
+        if not set(values) <= set(allowed):
+            raise typer.BadParameter(f"{name} must be in {allowed}")
+    results = run_benchmark(
+        database,
+        {
+            "users": users,
+            "contents": contents,
+            "requests": requests,
+            "concurrency": concurrency,
+            "modes": mode,
+            "flows": flow,
+        },
+    )
+    typer.echo(json.dumps(results, indent=2))
+    if output is not None:
+        json.dump(results, output, indent=2)
+
+
+@cli.command()
+def create_db():
+    """Create the database tables and indexes, and add new columns"""
+    from .db import create_db_and_tables, get_engine
+
+    migrated = create_db_and_tables(get_engine())
+    if migrated["slugs"]:
+        typer.echo(f"renamed {migrated['slugs']} duplicate slugs")
+    if migrated["tags"]:
+        typer.echo(f"migrated tags of {migrated['tags']} contents")
+    typer.echo("database is up to date")
+
+
+@cli.command()
+def migrate_tags():
+    """Move comma joined content tags to the indexed tags table"""
+    from .db import create_db_and_tables, get_engine
+
+    # the migration is part of updating the database
+    migrated = create_db_and_tables(get_engine())
+    typer.echo(f"migrated tags of {migrated['tags']} contents")
+
+
 @cli.command()
 def shell():  # pragma: no cover
     """Opens an interactive shell with objects auto imported"""
+    from sqlmodel import Session, select
+
+    from .app import app
+    from .db import get_engine
+    from .models.content import Content
+    from .security import User
+
+    engine = get_engine()
     _vars = {
         "app": app,
         "settings": settings,
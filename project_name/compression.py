@@ -0,0 +1,217 @@
+"""Compression of responses negotiated with `Accept-Encoding`.
+
+gzip is always available, brotli (`br`) and zstd when the `brotli` and
+`zstandard` packages are installed. Among the encodings the client
+accepts, the one with the highest q-value wins, ties go to the first of
+`settings.server.compression_encodings`.
+
+Only responses of the allowed content types, without a
+`Content-Encoding` already, are compressed. A response sent in one
+message is compressed when it reaches `compression_min_size` bytes.
+Streamed responses (`more_body`) are always compressed, chunk by chunk,
+each chunk flushed so the client gets it without waiting for the end.
+"""
+
+import zlib
+from typing import Dict, Iterable, List, Optional
+
+from .config import settings
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+DEFAULT_LEVELS = {"gzip": 6, "br": 4, "zstd": 3}
+
+COMPRESSION_MIN_SIZE = settings.get("server.compression_min_size", 1024)
+COMPRESSION_TYPES = settings.get(
+    "server.compression_types", ["application/json", "text/"]
+)
+COMPRESSION_ENCODINGS = settings.get(
+    "server.compression_encodings", ["zstd", "br", "gzip"]
+)
+COMPRESSION_LEVELS = settings.get("server.compression_levels", {})
+
+
+class GzipCompressor:
+    def __init__(self, level: int):
+        # wbits 16 + 15 writes the gzip header and trailer
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, flush: bool = False) -> bytes:
+        output = self.compressor.compress(data)
+        if flush:
+            output += self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        return output
+
+    def finish(self) -> bytes:
+        return self.compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliCompressor:
+    def __init__(self, level: int):
+        self.compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data: bytes, flush: bool = False) -> bytes:
+        output = self.compressor.process(data)
+        if flush:
+            output += self.compressor.flush()
+        return output
+
+    def finish(self) -> bytes:
+        return self.compressor.finish()
+
+
+class ZstdCompressor:
+    def __init__(self, level: int):
+        self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes, flush: bool = False) -> bytes:
+        output = self.compressor.compress(data)
+        if flush:
+            output += self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        return output
+
+    def finish(self) -> bytes:
+        return self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+COMPRESSORS: Dict = {"gzip": GzipCompressor}
+if brotli is not None:  # pragma: no cover
+    COMPRESSORS["br"] = BrotliCompressor
+if zstandard is not None:  # pragma: no cover
+    COMPRESSORS["zstd"] = ZstdCompressor
+
+
+def negotiate(accept_encoding: str, encodings: Iterable[str]) -> str:
+    """The preferred of `encodings` accepted by the client, if any.
+    >>> negotiate("gzip;q=0.5, br", ["zstd", "br", "gzip"])
+    'br'
+    """
+    accepted: Dict[str, float] = {}
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip()] = quality
+    best, best_quality = "", 0.0
+    for encoding in encodings:
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def header(headers: List, name: bytes) -> Optional[bytes]:
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+class CompressionMiddleware:
+    def __init__(
+        self,
+        app,
+        minimum_size: int = COMPRESSION_MIN_SIZE,
+        content_types: Iterable[str] = COMPRESSION_TYPES,
+        levels: Optional[Dict[str, int]] = COMPRESSION_LEVELS,
+        encodings: Iterable[str] = COMPRESSION_ENCODINGS,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.content_types = tuple(content_types)
+        self.levels = {**DEFAULT_LEVELS, **(levels or {})}
+        # in order of preference, those that can be used
+        self.encodings = [name for name in encodings if name in COMPRESSORS]
+
+    def compressible(self, headers: List) -> bool:
+        if header(headers, b"content-encoding") is not None:
+            return False
+        content_type = (header(headers, b"content-type") or b"").decode(
+            "latin-1"
+        )
+        return content_type.startswith(self.content_types)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept_encoding = header(scope["headers"], b"accept-encoding")
+        encoding = negotiate(
+            (accept_encoding or b"").decode("latin-1"), self.encodings
+        )
+        if not encoding:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        compressor = None
+
+        async def send_compressed(message):
+            nonlocal start, compressor
+            if message["type"] == "http.response.start":
+                # sent with the first body, once the size is known
+                start = message
+                return
+            if message["type"] != "http.response.body" or start is None:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                headers = list(start.get("headers", []))
+                if start["status"] < 200 or start["status"] in (204, 304):
+                    compressible = False
+                else:
+                    compressible = self.compressible(headers)
+                if compressible:
+                    # the response depends on Accept-Encoding
+                    headers.append((b"vary", b"Accept-Encoding"))
+                if not compressible or (
+                    not more_body and len(body) < self.minimum_size
+                ):
+                    await send({**start, "headers": headers})
+                    start = None
+                    await send(message)
+                    return
+                compressor = COMPRESSORS[encoding](self.levels[encoding])
+                headers = [
+                    (key, value)
+                    for key, value in headers
+                    if key.lower() != b"content-length"
+                ]
+                headers.append((b"content-encoding", encoding.encode()))
+                if more_body:
+                    body = compressor.compress(body, flush=True)
+                else:
+                    body = compressor.compress(body) + compressor.finish()
+                    headers.append(
+                        (b"content-length", str(len(body)).encode())
+                    )
+                await send({**start, "headers": headers})
+            elif more_body:
+                body = compressor.compress(body, flush=True)
+            else:
+                body = compressor.compress(body) + compressor.finish()
+            await send(
+                {
+                    "type": "http.response.body",
+                    "body": body,
+                    "more_body": more_body,
+                }
+            )
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,84 @@
+"""Conditional GET support, `ETag` / `Last-Modified` and 304 responses.
+
+Validators are computed from `(id, modified_time)` versions, which can
+be selected on their own so a request that would get a 304 never loads
+nor serializes the full rows.
+"""
+
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Iterable, Optional, Tuple
+
+from fastapi import Request, Response
+from sqlalchemy import func
+
+from .models.content import Content
+
+Validators = Tuple[str, Optional[datetime]]
+
+
+def content_version_columns():
+    """The columns to select the version of contents without the rows."""
+    return (
+        Content.id,
+        func.coalesce(Content.updated_time, Content.created_time),
+    )
+
+
+def make_validators(versions: Iterable[Tuple], *extra) -> Validators:
+    """Build a weak ETag and the Last-Modified date of a set of versions,
+    `extra` holds anything else that changes the response."""
+    versions = sorted(tuple(version) for version in versions)
+    digest = hashlib.sha1(repr((extra, versions)).encode()).hexdigest()
+    last_modified = max(
+        (
+            datetime.fromisoformat(modified).astimezone(timezone.utc)
+            for _, modified in versions
+        ),
+        default=None,
+    )
+    return f'W/"{digest}"', last_modified
+
+
+def is_conditional(request: Request) -> bool:
+    return (
+        "if-none-match" in request.headers
+        or "if-modified-since" in request.headers
+    )
+
+
+def is_not_modified(request: Request, validators: Validators) -> bool:
+    etag, last_modified = validators
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # weak comparison, If-Modified-Since is ignored when present
+        tags = {
+            tag.strip().removeprefix("W/") for tag in if_none_match.split(",")
+        }
+        return "*" in tags or etag.removeprefix("W/") in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+
+def set_validators(response: Response, validators: Validators):
+    etag, last_modified = validators
+    response.headers["ETag"] = etag
+    if last_modified:
+        response.headers["Last-Modified"] = format_datetime(
+            last_modified, usegmt=True
+        )
+
+
+def not_modified(validators: Validators) -> Response:
+    response = Response(status_code=304)
+    set_validators(response, validators)
+    return response
@@ -1,22 +1,381 @@
-from fastapi import Depends
+import functools
+import hashlib
+import itertools
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from fastapi import Depends, Request
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import Session as OrmSession
 from sqlmodel import Session, SQLModel, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from .config import settings
+from .models.content import deduplicate_slugs, migrate_legacy_tags
+from .search import create_search_index
+from .sqlitestore import SQLiteStore
+
+# Maps the sync dialect of `settings.db.uri` to its async driver.
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgres": "postgresql+asyncpg",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+def get_async_uri(uri: str) -> str:
+    """Translate a database URI to the equivalent async driver URI.
+    >>> get_async_uri("sqlite:///testing.db")
+    'sqlite+aiosqlite:///testing.db'
+    """
+    scheme, separator, rest = uri.partition("://")
+    dialect = scheme.split("+")[0]
+    return f"{ASYNC_DRIVERS.get(dialect, scheme)}{separator}{rest}"
+
+
+def get_engine_options(uri: str) -> dict:
+    """Build the `create_engine` keyword arguments from `settings.db`.
+
+    Pool sizing only applies to queue pools, SQLite engines get a pool
+    that does not accept those arguments.
+    """
+    options = {
+        "echo": settings.db.echo,
+        "connect_args": settings.db.connect_args,
+        "pool_pre_ping": settings.db.get("pool_pre_ping", False),
+        "pool_recycle": settings.db.get("pool_recycle", -1),
+    }
+    if not uri.startswith("sqlite"):
+        options.update(
+            pool_size=settings.db.get("pool_size", 5),
+            max_overflow=settings.db.get("max_overflow", 10),
+            pool_timeout=settings.db.get("pool_timeout", 30),
+        )
+    return options
+
+
+class PoolMetrics:
+    """Live connection pool statistics of an engine.
+
+    Checkout wait time is measured around the pool's own connection
+    retrieval, so it includes the time spent waiting for a free slot.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.in_use = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        event.listen(engine, "checkout", self.on_checkout)
+        event.listen(engine, "checkin", self.on_checkin)
+        event.listen(engine, "engine_disposed", self.instrument)
+        self.instrument(engine)
+
+    def instrument(self, engine):
+        """Time every connection retrieval of the engine's current pool.
+
+        The pool events only fire once a connection was retrieved, so the
+        wait is timed around the private `Pool._do_get` of SQLAlchemy 1.4,
+        the version pinned in requirements.txt. Without it only the
+        checkouts are counted.
+        """
+        pool = engine.pool
+        do_get = getattr(pool, "_do_get", None)
+        if do_get is None:  # pragma: no cover
+            return
+
+        def timed_do_get():
+            start = time.perf_counter()
+            try:
+                return do_get()
+            except PoolTimeoutError:
+                with self.lock:
+                    self.timeouts += 1
+                raise
+            finally:
+                self.record_wait(time.perf_counter() - start)
+
+        pool._do_get = timed_do_get
+
+    def record_wait(self, elapsed: float):
+        with self.lock:
+            self.wait_time += elapsed
+            self.max_wait_time = max(self.max_wait_time, elapsed)
+
+    def on_checkout(self, dbapi_connection, connection_record, proxy):
+        with self.lock:
+            self.checkouts += 1
+            self.in_use += 1
+
+    def on_checkin(self, dbapi_connection, connection_record):
+        with self.lock:
+            self.in_use -= 1
+
+    def stats(self) -> dict:
+        pool = self.engine.pool
+        return {
+            "pool": type(pool).__name__,
+            "size": pool.size() if hasattr(pool, "size") else None,
+            "overflow": pool.overflow() if hasattr(pool, "overflow") else 0,
+            "in_use": self.in_use,
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "wait_time_total": round(self.wait_time, 6),
+            "wait_time_max": round(self.max_wait_time, 6),
+            "wait_time_avg": (
+                round(self.wait_time / self.checkouts, 6)
+                if self.checkouts
+                else 0.0
+            ),
+        }
+
+
+def created_once(create):
+    """Call `create` on first use only, later calls return its result."""
+    lock = threading.Lock()
+    created = []
+
+    @functools.wraps(create)
+    def get():
+        if not created:
+            with lock:
+                if not created:
+                    created.append(create())
+        return created[0]
+
+    return get
+
+
+# Live pool statistics of every engine created, shown on GET /health.
+pool_metrics: Dict[str, PoolMetrics] = {}
+
+
+@created_once
+def get_engine():
+    """The sync engine, used by the CLI and to create the schema."""
+    engine = create_engine(
+        settings.db.uri, **get_engine_options(settings.db.uri)
+    )
+    pool_metrics["engine"] = PoolMetrics(engine)
+    return engine
+
+
+@created_once
+def get_async_engine():
+    """The async engine of the API sessions."""
+    uri = settings.db.get("async_uri") or get_async_uri(settings.db.uri)
+    engine = create_async_engine(uri, **get_engine_options(uri))
+    pool_metrics["async_engine"] = PoolMetrics(engine.sync_engine)
+    return engine
+
+
+@created_once
+def get_replica_engines() -> List:
+    """Read only copies of the database, served by `get_read_session`."""
+    replicas = [
+        create_async_engine(uri, **get_engine_options(uri))
+        for uri in map(get_async_uri, settings.db.get("replica_uris", []))
+    ]
+    for number, replica in enumerate(replicas):
+        pool_metrics[f"replica_{number}"] = PoolMetrics(replica.sync_engine)
+    return replicas
+
+
+def __getattr__(name: str):
+    # engines are created on first use, `db.engine` still works
+    lazy = {
+        "engine": get_engine,
+        "async_engine": get_async_engine,
+        "replica_engines": get_replica_engines,
+    }
+    if name in lazy:
+        return lazy[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def dispose_inherited_engines():
+    """Give a forked process its own connection pools.
+
+    Connections of the parent can't be shared, the child drops them
+    without closing them, which would break them for the parent too.
+    """
+    for metrics in pool_metrics.values():
+        # another thread may have held the lock when the process forked
+        metrics.lock = threading.Lock()
+        metrics.in_use = 0
+        metrics.engine.dispose(close=False)
 
-engine = create_engine(
-    settings.db.uri,
-    echo=settings.db.echo,
-    connect_args=settings.db.connect_args,
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=dispose_inherited_engines)
+
+replica_counter = itertools.count()
+
+
+class RecentWriters(SQLiteStore):
+    """Writers that committed in the last `ttl` seconds, stored in the
+    SQLite database at `path` so the workers of a host share them.
+
+    Writers are hashed, the tokens are not written to the disk.
+    """
+
+    schema = (
+        "CREATE TABLE IF NOT EXISTS recent_writer ("
+        "writer TEXT PRIMARY KEY, expires REAL)"
+    )
+
+    def __init__(self, path: str, ttl: float = 5):
+        super().__init__(path)
+        self.ttl = ttl
+        self.pruned = 0.0
+
+    @staticmethod
+    def key(writer: str) -> str:
+        return hashlib.sha256(writer.encode()).hexdigest()
+
+    def add(self, writer: str, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        connection = self.connection()
+        connection.execute(
+            "INSERT INTO recent_writer (writer, expires) VALUES (?, ?) "
+            "ON CONFLICT (writer) DO UPDATE SET expires = excluded.expires",
+            (self.key(writer), now + self.ttl),
+        )
+        if now - self.pruned > self.ttl:
+            self.pruned = now
+            connection.execute(
+                "DELETE FROM recent_writer WHERE expires < ?", (now,)
+            )
+
+    def __contains__(self, writer: str) -> bool:
+        row = (
+            self.connection()
+            .execute(
+                "SELECT 1 FROM recent_writer WHERE writer = ? AND expires > ?",
+                (self.key(writer), time.time()),
+            )
+            .fetchone()
+        )
+        return row is not None
+
+    def clear(self):
+        self.connection().execute("DELETE FROM recent_writer")
+
+
+# Writers, a token or "user:<username>", that committed in the last
+# `replica_lag` seconds. Their reads stay on the primary until the
+# replicas caught up, so they read their own writes, whatever the worker.
+recent_writers = RecentWriters(
+    settings.db.get("recent_writers_store", "recent_writers.db"),
+    settings.db.get("replica_lag", 5),
 )
 
 
-def create_db_and_tables(engine):
+def add_missing_columns(engine):
+    """Add nullable columns declared after their table was created."""
+    inspector = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+    with engine.begin() as connection:
+        for table in SQLModel.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                # quoted, `user` is a reserved word on PostgreSQL
+                connection.exec_driver_sql(
+                    f"ALTER TABLE {preparer.format_table(table)} "
+                    f"ADD COLUMN {preparer.format_column(column)} "
+                    f"{column_type}"
+                )
+
+
+def create_db_and_tables(engine) -> Dict[str, int]:
+    """Create or update the schema and migrate the data to it.
+
+    Returns the number of contents whose slug was renamed and of those
+    whose legacy tags were moved.
+    """
+    # registers `User` in the metadata, imported here as it imports us
+    from . import security  # noqa: F401
+
     SQLModel.metadata.create_all(engine)
+    # create_all skips existing tables, add what was declared after them
+    add_missing_columns(engine)
+    with Session(engine) as session:
+        # the unique slug index can't be created over duplicates
+        migrated = {"slugs": deduplicate_slugs(session)}
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+    create_search_index(engine)
+    # the API only reads tags from `ContentTag`
+    with Session(engine) as session:
+        migrated["tags"] = migrate_legacy_tags(session)
+    return migrated
 
 
 def get_session():
-    with Session(engine) as session:
+    with Session(get_engine()) as session:
         yield session
 
 
 ActiveSession = Depends(get_session)
+
+
+def remember_write(writer: str):
+    """Keep the reads of `writer` on the primary for `replica_lag`."""
+    # without replicas every read is on the primary already
+    if get_replica_engines():
+        recent_writers.add(writer)
+
+
+@event.listens_for(OrmSession, "after_commit")
+def remember_writer(session):
+    writer = session.info.get("writer")
+    if writer is not None:
+        remember_write(writer)
+
+
+def get_read_engine(*writers: Optional[str]):
+    """Pick the next replica, or the primary when there are none or when
+    one of the `writers` committed recently."""
+    replicas = get_replica_engines()
+    if not replicas or any(
+        writer is not None and writer in recent_writers for writer in writers
+    ):
+        return get_async_engine()
+    return replicas[next(replica_counter) % len(replicas)]
+
+
+async def get_async_session(request: Request):
+    # objects are kept loaded after commit, lazy loading is not possible
+    # on async sessions so they would be unusable otherwise.
+    async with AsyncSession(
+        get_async_engine(), expire_on_commit=False
+    ) as session:
+        session.info["writer"] = request.headers.get("authorization")
+        yield session
+
+
+AsyncActiveSession = Depends(get_async_session)
+
+
+async def get_read_session(request: Request):
+    """A session on a replica for routes that only read, requests of a
+    token that just wrote are served by the primary."""
+    engine = get_read_engine(request.headers.get("authorization"))
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        yield session
+
+
+AsyncReadSession = Depends(get_read_session)
@@ -0,0 +1,106 @@
+"""Streaming export of contents and users as NDJSON or a JSON array.
+
+Rows are read with `yield_per`, a server-side cursor where the driver
+supports it, and encoded one batch at a time, so memory stays flat no
+matter how large the table gets.
+"""
+
+import json
+from typing import AsyncIterator, Dict, Iterable, Iterator, List
+
+from fastapi import Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import noload
+from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from .config import settings
+from .db import get_async_engine
+from .models.content import Content, select_contents
+from .responses import orjson, serialize_content, serialize_user
+from .security import User
+
+EXPORT_BATCH_SIZE = settings.get("export.batch_size", 500)
+
+FORMATS = ("ndjson", "json")
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "json": "application/json"}
+# opening and closing bytes of the whole export
+FRAMES = {"ndjson": (b"", b""), "json": (b"[", b"]\n")}
+
+ExportFormat = Query("ndjson", regex=f"^({'|'.join(FORMATS)})$")
+
+EXPORTS = {
+    "content": (
+        lambda: select_contents().order_by(Content.id),
+        serialize_content,
+    ),
+    "users": (
+        lambda: select(User).options(noload(User.contents)).order_by(User.id),
+        lambda user: serialize_user(user, include_contents=False),
+    ),
+}
+
+
+def dumps(item: Dict) -> bytes:
+    if orjson is None:  # pragma: no cover
+        return json.dumps(item).encode()
+    return orjson.dumps(item)
+
+
+def encode_batch(items: List[Dict], format: str, first: bool) -> bytes:
+    """Encode a batch of items, `first` tells if any was encoded before."""
+    if format == "ndjson":
+        return b"".join(dumps(item) + b"\n" for item in items)
+    encoded = b",".join(dumps(item) for item in items)
+    return encoded if first else b"," + encoded
+
+
+def export_batches(
+    session: Session, kind: str, batch_size: int = EXPORT_BATCH_SIZE
+) -> Iterator[List[Dict]]:
+    statement, serialize = EXPORTS[kind]
+    result = session.execute(
+        statement().execution_options(yield_per=batch_size)
+    )
+    for batch in result.scalars().partitions():
+        yield [serialize(row) for row in batch]
+
+
+def encode_export(
+    batches: Iterable[List[Dict]], format: str
+) -> Iterator[bytes]:
+    start, end = FRAMES[format]
+    yield start
+    first = True
+    for batch in batches:
+        if batch:
+            yield encode_batch(batch, format, first)
+            first = False
+    yield end
+
+
+async def stream_export(
+    kind: str, format: str, batch_size: int = EXPORT_BATCH_SIZE
+) -> AsyncIterator[bytes]:
+    """Generate the export for a StreamingResponse, on its own session as
+    the response is sent after the route returned."""
+    statement, serialize = EXPORTS[kind]
+    start, end = FRAMES[format]
+    yield start
+    first = True
+    async with AsyncSession(get_async_engine()) as session:
+        result = await session.stream(
+            statement().execution_options(yield_per=batch_size)
+        )
+        rows = result.scalars()
+        while batch := await rows.fetchmany(batch_size):
+            items = [serialize(row) for row in batch]
+            yield encode_batch(items, format, first)
+            first = False
+    yield end
+
+
+def export_response(kind: str, format: str) -> StreamingResponse:
+    return StreamingResponse(
+        stream_export(kind, format), media_type=MEDIA_TYPES[format]
+    )
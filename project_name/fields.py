@@ -0,0 +1,89 @@
+"""Sparse fieldsets, `?fields=id,title,slug` returns only those fields.
+
+The fields narrow the query as well as the response: the columns no field
+needs, like the `text` of contents, are not selected (`load_only`) and
+tags are only loaded when `tags` is asked. Those responses are serialized
+straight to JSON by `responses.fast_json`, the response_model would read
+the columns left out.
+
+On user endpoints `contents` returns all the fields of the contents and
+`contents.<field>` some of them, e.g. `?fields=username,contents.title`.
+"""
+
+from typing import List, Optional, Tuple
+
+from fastapi import Depends, HTTPException, Query
+
+from .models.content import ContentResponse
+from .security import UserResponse
+
+CONTENT_FIELDS = tuple(ContentResponse.__fields__)
+USER_FIELDS = tuple(UserResponse.__fields__)
+
+FIELDS_DESCRIPTION = "Comma separated fields to return, all by default."
+
+
+def parse_fields(value: str, allowed: Tuple[str, ...]) -> List[str]:
+    """The fields named in `value`, in the order of `allowed`.
+    >>> parse_fields("slug, id", ("id", "title", "slug"))
+    ['id', 'slug']
+    """
+    names = {name.strip() for name in value.split(",")} - {""}
+    unknown = names - set(allowed)
+    if unknown or not names:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields {sorted(unknown)}, "
+            f"choose from {list(allowed)}",
+        )
+    return [name for name in allowed if name in names]
+
+
+class ContentFields:
+    def __init__(
+        self,
+        fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    ):
+        self.fields = parse_fields(fields, CONTENT_FIELDS) if fields else None
+
+    def validators(self) -> tuple:
+        """What to add to the ETag of responses with fields."""
+        return () if self.fields is None else (self.fields,)
+
+
+class UserFields:
+    def __init__(
+        self,
+        fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    ):
+        self.fields: Optional[List[str]] = None
+        self.content_fields: Optional[List[str]] = None
+        if not fields:
+            return
+        names = [name.strip() for name in fields.split(",")]
+        nested = [
+            name.partition(".")[2]
+            for name in names
+            if name.startswith("contents.")
+        ]
+        if nested:
+            names.append("contents")
+            self.content_fields = parse_fields(
+                ",".join(nested), CONTENT_FIELDS
+            )
+        self.fields = parse_fields(
+            ",".join(name for name in names if "." not in name), USER_FIELDS
+        )
+
+    @property
+    def contents(self) -> bool:
+        return self.fields is None or "contents" in self.fields
+
+    def validators(self) -> tuple:
+        if self.fields is None:
+            return ()
+        return (self.fields, self.content_fields)
+
+
+ContentFieldset = Depends(ContentFields)
+UserFieldset = Depends(UserFields)
@@ -0,0 +1,161 @@
+"""Streaming bulk import of users from CSV or JSON lines files."""
+
+import csv
+import json
+import time
+from concurrent.futures import Executor
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, TextIO
+
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, col, select
+
+from .security import User, get_password_hash
+
+FORMATS = ("csv", "jsonl")
+
+
+def guess_format(filename: str) -> str:
+    """
+    >>> guess_format("users.csv")
+    'csv'
+    """
+    return "csv" if filename.lower().endswith(".csv") else "jsonl"
+
+
+def read_users(file: TextIO, format: str) -> Iterator[Dict]:
+    """Stream the records of a CSV file with a header or a JSONL file."""
+    if format == "csv":
+        yield from csv.DictReader(file)
+        return
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
+
+def parse_bool(value) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "y")
+    return bool(value)
+
+
+def batched(iterable: Iterable, size: int) -> Iterator[List]:
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class ImportReport:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.processed = 0
+        self.imported = 0
+        self.duplicates: List[str] = []
+        self.invalid = 0
+
+    @property
+    def throughput(self) -> float:
+        elapsed = time.perf_counter() - self.started
+        return self.processed / elapsed if elapsed else 0.0
+
+    def __str__(self):
+        return (
+            f"{self.processed} processed, {self.imported} imported, "
+            f"{len(self.duplicates)} duplicates, {self.invalid} invalid, "
+            f"{self.throughput:.0f} users/s"
+        )
+
+
+def import_users(
+    engine,
+    records: Iterable[Dict],
+    executor: Executor,
+    batch_size: int = 500,
+    on_batch: Callable[[ImportReport], None] = lambda report: None,
+    on_duplicate: Callable[[str], None] = lambda username: None,
+) -> ImportReport:
+    """Insert the users of `records` in batches of `batch_size`.
+
+    Passwords of each batch are hashed in parallel on `executor`. Usernames
+    already taken, in the database or earlier in the records, are skipped
+    and reported to `on_duplicate` instead of aborting the import.
+    """
+    report = ImportReport()
+    seen = set()
+
+    def skip(username: str):
+        report.duplicates.append(username)
+        on_duplicate(username)
+
+    with Session(engine) as session:
+        for batch in batched(records, batch_size):
+            report.processed += len(batch)
+            rows = []
+            for record in batch:
+                username = str(record.get("username") or "").strip()
+                password = record.get("password")
+                if not username or not password:
+                    report.invalid += 1
+                elif username in seen:
+                    skip(username)
+                else:
+                    seen.add(username)
+                    rows.append(
+                        {
+                            "username": username,
+                            "password": str(password),
+                            "superuser": parse_bool(record.get("superuser")),
+                            "disabled": parse_bool(record.get("disabled")),
+                        }
+                    )
+
+            taken = set(
+                session.exec(
+                    select(User.username).where(
+                        col(User.username).in_(
+                            [row["username"] for row in rows]
+                        )
+                    )
+                ).all()
+            )
+            for username in taken:
+                skip(username)
+            rows = [row for row in rows if row["username"] not in taken]
+            # don't hold the read transaction, and its lock, while hashing
+            session.commit()
+
+            hashes = executor.map(
+                get_password_hash,
+                [row["password"] for row in rows],
+                chunksize=max(1, len(rows) // 32),
+            )
+            for row, hashed in zip(rows, hashes):
+                row["password"] = hashed
+
+            report.imported += insert_users(session, rows, skip)
+            on_batch(report)
+    return report
+
+
+def insert_users(session: Session, rows: List[Dict], skip) -> int:
+    """Insert `rows` at once, or one by one if a username got taken in
+    the meantime, returns how many were inserted."""
+    if not rows:
+        return 0
+    try:
+        session.execute(insert(User), rows)
+        session.commit()
+        return len(rows)
+    except IntegrityError:
+        session.rollback()
+    inserted = 0
+    for row in rows:
+        try:
+            session.execute(insert(User), [row])
+            session.commit()
+            inserted += 1
+        except IntegrityError:
+            session.rollback()
+            skip(row["username"])
+    return inserted
@@ -0,0 +1,192 @@
+"""Request metrics exposed in the Prometheus text format on `/metrics`.
+
+`MetricsMiddleware` is a plain ASGI middleware, it only wraps `send` to
+read the status code and labels requests with the template of the route
+that handled them, e.g. `/content/{id_or_slug}/`, so the number of series
+doesn't grow with the number of urls.
+
+Each worker process counts its own requests and a scrape is answered by
+one of them, every series is labelled with the `worker` pid so they are
+told apart, e.g. `sum without (worker)` in queries.
+"""
+
+import os
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+from fastapi import Response
+
+from .config import settings
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)  # fmt: skip
+
+UNMATCHED = "<unmatched>"
+
+
+class RequestMetrics:
+    """Counters and latency histograms per (method, route) and status.
+
+    Only updated from the event loop, so no locking is needed.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets: List[float] = sorted(buckets)
+        self.in_flight = 0
+        self.statuses: Dict[Tuple[str, str, int], int] = defaultdict(int)
+        # per (method, route): a count per bucket plus +Inf, and the sum
+        self.histograms: Dict[Tuple[str, str], List] = {}
+        # per (method, route): queries, their time and N+1 requests
+        self.queries: Dict[Tuple[str, str], List] = {}
+
+    def observe(self, method: str, route: str, status: int, elapsed: float):
+        self.statuses[method, route, status] += 1
+        histogram = self.histograms.get((method, route))
+        if histogram is None:
+            histogram = self.histograms[method, route] = [
+                [0] * (len(self.buckets) + 1),
+                0.0,
+            ]
+        histogram[0][bisect_left(self.buckets, elapsed)] += 1
+        histogram[1] += elapsed
+
+    def observe_queries(self, method: str, route: str, trace):
+        """Add the `sqltrace.QueryTrace` of a request."""
+        queries = self.queries.get((method, route))
+        if queries is None:
+            queries = self.queries[method, route] = [0, 0.0, 0]
+        queries[0] += trace.count
+        queries[1] += trace.duration
+        queries[2] += bool(trace.n_plus_one)
+
+    def render(self) -> str:
+        # read here, a forked worker has its own pid
+        worker = f'worker="{os.getpid()}"'
+        lines = [
+            "# HELP http_requests_in_progress Requests being handled.",
+            "# TYPE http_requests_in_progress gauge",
+            f"http_requests_in_progress{{{worker}}} {self.in_flight}",
+            "# HELP http_requests_total Requests by route and status.",
+            "# TYPE http_requests_total counter",
+        ]
+        for (method, route, status), count in sorted(self.statuses.items()):
+            lines.append(
+                f'http_requests_total{{{worker},method="{method}",'
+                f'route="{escape(route)}",status="{status}"}} {count}'
+            )
+        lines += [
+            "# HELP http_request_duration_seconds Request latency by route.",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        bounds = [str(bucket) for bucket in self.buckets] + ["+Inf"]
+        for (method, route), (counts, total) in sorted(
+            self.histograms.items()
+        ):
+            labels = f'{worker},method="{method}",route="{escape(route)}"'
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                lines.append(
+                    f"http_request_duration_seconds_bucket"
+                    f'{{{labels},le="{bound}"}} {cumulative}'
+                )
+            lines.append(
+                f"http_request_duration_seconds_sum{{{labels}}} {total}"
+            )
+            lines.append(
+                f"http_request_duration_seconds_count{{{labels}}} "
+                f"{cumulative}"
+            )
+        if self.queries:
+            lines += render_queries(self.queries, worker)
+        return "\n".join(lines) + "\n"
+
+
+def render_queries(
+    queries: Dict[Tuple[str, str], List], worker: str
+) -> List[str]:
+    metrics = [
+        ("db_queries_total", "counter", "Queries run by route."),
+        ("db_query_duration_seconds_total", "counter", "Query time by route."),
+        ("db_n_plus_one_total", "counter", "Requests with N+1 queries."),
+    ]
+    lines = []
+    for position, (name, kind, description) in enumerate(metrics):
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+        for (method, route), values in sorted(queries.items()):
+            lines.append(
+                f'{name}{{{worker},method="{method}",'
+                f'route="{escape(route)}"}} '
+                f"{values[position]}"
+            )
+    return lines
+
+
+def escape(value: str) -> str:
+    """Escape a label value."""
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+class MetricsMiddleware:
+    def __init__(self, app, metrics: RequestMetrics, router):
+        self.app = app
+        self.metrics = metrics
+        self.router = router
+        self.templates: Dict = {}
+
+    def route_template(self, endpoint) -> str:
+        """The path template of the route serving `endpoint`."""
+        if endpoint is None:
+            return UNMATCHED
+        template = self.templates.get(endpoint)
+        if template is None:
+            # routes can be added after startup, map them on first use
+            self.templates = {
+                route.endpoint: route.path
+                for route in self.router.routes
+                if hasattr(route, "endpoint")
+            }
+            template = self.templates.setdefault(endpoint, UNMATCHED)
+        return template
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        self.metrics.in_flight += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.metrics.in_flight -= 1
+            # the router stores the matched endpoint in the shared scope
+            route = self.route_template(scope.get("endpoint"))
+            self.metrics.observe(scope["method"], route, status, elapsed)
+            # set by QueryTraceMiddleware when queries are traced
+            trace = scope.get("query_trace")
+            if trace is not None:
+                self.metrics.observe_queries(scope["method"], route, trace)
+
+
+request_metrics = RequestMetrics(
+    settings.get("server.metrics_buckets", DEFAULT_BUCKETS)
+)
+
+
+async def metrics_endpoint(request):
+    return Response(
+        request_metrics.render(), media_type="text/plain; version=0.0.4"
+    )
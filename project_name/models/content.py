@@ -1,8 +1,10 @@
 from datetime import datetime
-from typing import TYPE_CHECKING, List, Optional, Union
+from typing import TYPE_CHECKING, Iterable, List, Optional, Union
 
 from pydantic import BaseModel, Extra
-from sqlmodel import Field, Relationship, SQLModel
+from sqlalchemy import Column, Index, String, cast, exists, func, update
+from sqlalchemy.orm import aliased, load_only, selectinload
+from sqlmodel import Field, Relationship, SQLModel, col, select
 
 if TYPE_CHECKING:
     from project_name.security import User
@@ -16,18 +18,207 @@ class Content(SQLModel, table=True):
 
     id: Optional[int] = Field(default=None, primary_key=True)
     title: str
-    slug: str = Field(default=None)
+    slug: str = Field(
+        default=None, index=True, sa_column_kwargs={"unique": True}
+    )
     text: str
     published: bool = False
     created_time: str = Field(
         default_factory=lambda: datetime.now().isoformat()
     )
-    tags: str = Field(default="")
+    # Set by `touch` on every change, NULL for rows older than this column
+    updated_time: Optional[str] = Field(
+        default_factory=lambda: datetime.now().isoformat()
+    )
+    # Comma joined tags of databases created before `ContentTag`, moved to
+    # that table by `create_db_and_tables`, new rows leave it empty.
+    legacy_tags: str = Field(
+        default="",
+        sa_column=Column("tags", String, nullable=False, server_default=""),
+    )
     user_id: Optional[int] = Field(foreign_key="user.id")
 
     # It populates a `.contents` attribute to the `User` model.
     user: Optional["User"] = Relationship(back_populates="contents")
 
+    tag_links: List["ContentTag"] = Relationship(
+        back_populates="content",
+        sa_relationship_kwargs={
+            "cascade": "all, delete-orphan",
+            "order_by": "ContentTag.position",
+        },
+    )
+
+    @property
+    def modified_time(self) -> str:
+        return self.updated_time or self.created_time
+
+    def touch(self):
+        self.updated_time = datetime.now().isoformat()
+
+    @property
+    def tags(self) -> List[str]:
+        return [link.name for link in self.tag_links]
+
+    def set_tags(self, tags: Iterable[str]):
+        self.tag_links = [
+            ContentTag(name=name, position=position)
+            for position, name in enumerate(tags)
+        ]
+
+
+class ContentTag(SQLModel, table=True):
+    """A tag of a Content, the (name, content_id) index serves tag filters."""
+
+    __table_args__ = (Index("ix_contenttag_name", "name", "content_id"),)
+
+    content_id: Optional[int] = Field(
+        default=None, foreign_key="content.id", primary_key=True
+    )
+    name: str = Field(primary_key=True)
+    position: int = 0
+
+    content: Optional[Content] = Relationship(back_populates="tag_links")
+
+
+# loaded whatever the fields, they make the version of a content
+VERSION_FIELDS = ("id", "created_time", "updated_time")
+
+
+def content_options(fields: Optional[Iterable[str]] = None, parent=None):
+    """Loader options of the contents for the `fields` of ContentResponse,
+    all by default, or of the contents of the `parent` relationship.
+
+    Only the columns of the fields and the version are selected, and the
+    tags in one additional query when asked.
+    """
+    related = selectinload(parent) if parent is not None else None
+    options = []
+    if fields is not None:
+        names = set(fields) - {"tags"} | set(VERSION_FIELDS)
+        if related is not None:
+            # the key related contents are grouped by
+            names.add("user_id")
+        columns = [getattr(Content, name) for name in sorted(names)]
+        options.append(
+            load_only(*columns)
+            if related is None
+            else related.load_only(*columns)
+        )
+    if fields is None or "tags" in fields:
+        options.append(
+            selectinload(Content.tag_links)
+            if related is None
+            else selectinload(parent).selectinload(Content.tag_links)
+        )
+    if related is not None and not options:
+        options.append(related)
+    return options
+
+
+def select_contents(fields: Optional[Iterable[str]] = None):
+    """Select contents with their tags loaded, as required by
+    ContentResponse, in one additional query for all the contents.
+
+    With `fields` only what they need is loaded, see `content_options`.
+    """
+    return select(Content).options(*content_options(fields))
+
+
+def filter_by_tags(
+    statement,
+    tag: Optional[str] = None,
+    tags_any: Optional[List[str]] = None,
+    tags_all: Optional[List[str]] = None,
+):
+    """Restrict a Content select to the tags, using the tag index."""
+    if tag:
+        statement = statement.where(
+            col(Content.id).in_(
+                select(ContentTag.content_id).where(ContentTag.name == tag)
+            )
+        )
+    if tags_any:
+        statement = statement.where(
+            col(Content.id).in_(
+                select(ContentTag.content_id).where(
+                    col(ContentTag.name).in_(tags_any)
+                )
+            )
+        )
+    if tags_all:
+        names = set(tags_all)
+        statement = statement.where(
+            col(Content.id).in_(
+                select(ContentTag.content_id)
+                .where(col(ContentTag.name).in_(names))
+                .group_by(ContentTag.content_id)
+                .having(func.count() == len(names))
+            )
+        )
+    return statement
+
+
+def split_tags(tags: Union[List[str], str, None]) -> List[str]:
+    """Normalize tags given as a list or a comma joined string.
+    >>> split_tags("a, b,,a")
+    ['a', 'b']
+    """
+    if not tags:
+        return []
+    if isinstance(tags, str):
+        tags = tags.split(",")
+    names = (name.strip() for name in tags)
+    return list(dict.fromkeys(name for name in names if name))
+
+
+def migrate_legacy_tags(session, batch_size: int = 500) -> int:
+    """Move comma joined `Content.legacy_tags` into `ContentTag` rows,
+    `batch_size` contents per transaction."""
+    migrated = 0
+    last_id = 0
+    while True:
+        contents = session.exec(
+            select_contents()
+            .where(Content.legacy_tags != "", col(Content.id) > last_id)
+            .order_by(Content.id)
+            .limit(batch_size)
+        ).all()
+        if not contents:
+            return migrated
+        for content in contents:
+            content.set_tags(
+                split_tags(content.tags + split_tags(content.legacy_tags))
+            )
+            content.legacy_tags = ""
+        last_id = contents[-1].id
+        migrated += len(contents)
+        session.commit()
+        # only the current batch stays in memory
+        session.expunge_all()
+
+
+def deduplicate_slugs(session) -> int:
+    """Rename the contents sharing the slug of an older one to
+    `<slug>-<id>`, slugs were not unique before the slug index."""
+    older = aliased(Content)
+    duplicates = select(Content.id).where(
+        exists()
+        .where(col(older.slug) == Content.slug)
+        .where(col(older.id) < Content.id)
+    )
+    result = session.execute(
+        update(Content)
+        .where(col(Content.id).in_(duplicates))
+        .values(
+            slug=col(Content.slug) + "-" + cast(col(Content.id), String),
+            updated_time=datetime.now().isoformat(),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    session.commit()
+    return result.rowcount
+
 
 class ContentResponse(BaseModel):
     """This the serializer exposed on the API"""
@@ -39,14 +230,12 @@ class ContentResponse(BaseModel):
     published: bool
     created_time: str
     tags: List[str]
-    user_id: int
+    # contents of deleted users are kept without an owner
+    user_id: Optional[int]
 
-    def __init__(self, *args, **kwargs):
-        # tags to model representation
-        tags = kwargs.pop("tags", None)
-        if tags and isinstance(tags, str):
-            kwargs["tags"] = tags.split(",")
-        super().__init__(*args, **kwargs)
+    class Config:
+        # reads `Content.tags` which is not a column
+        orm_mode = True
 
 
 class ContentIncoming(BaseModel):
@@ -62,14 +251,27 @@ class ContentIncoming(BaseModel):
         arbitrary_types_allowed = True
 
     def __init__(self, *args, **kwargs):
-        # tags to database representation
-        tags = kwargs.pop("tags", None)
-        if tags and isinstance(tags, list):
-            kwargs["tags"] = ",".join(tags)
         super().__init__(*args, **kwargs)
+        if self.tags is not None:
+            self.tags = split_tags(self.tags)
         self.generate_slug()
 
     def generate_slug(self):
         """Generate a slug from the title."""
         if self.title:
             self.slug = self.title.lower().replace(" ", "-")
+
+
+class ContentBulkPatch(ContentIncoming):
+    """This is the serializer for each item of a bulk PATCH request"""
+
+    id: int
+
+
+class ContentBulkResult(BaseModel):
+    """This is the outcome of each item of a bulk request"""
+
+    id: Optional[int]
+    status: int
+    detail: Optional[str]
+    content: Optional[ContentResponse]
@@ -0,0 +1,79 @@
+import base64
+import json
+from typing import List, Optional
+
+from fastapi import Depends, HTTPException, Query, Response
+
+from .config import settings
+
+DEFAULT_PAGE_SIZE = settings.pagination.default_page_size
+MAX_PAGE_SIZE = settings.pagination.max_page_size
+
+
+def encode_cursor(key) -> str:
+    """Make an opaque cursor pointing after the row with the given key."""
+    return base64.urlsafe_b64encode(json.dumps([key]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> int:
+    """The key of a cursor made by `encode_cursor`, the ids and offsets
+    used as keys are non negative integers."""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))[0]
+    except (ValueError, TypeError, IndexError, KeyError):
+        key = None
+    # a bool is an int too
+    if type(key) is not int or key < 0:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return key
+
+
+class Pagination:
+    """Keyset pagination parameters for list endpoints.
+
+    Rows are ordered by a unique indexed column, the cursor holds the last
+    key of the previous page so every page is a range scan on the index
+    no matter how deep it is. The cursor for the next page is sent on the
+    `X-Next-Cursor` header, it is absent on the last page.
+    """
+
+    def __init__(
+        self,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        cursor: Optional[str] = None,
+    ):
+        self.limit = limit
+        self.after = decode_cursor(cursor) if cursor else None
+
+    def paginate(self, statement, key):
+        """Restrict a select `statement` to the requested page of `key`."""
+        if self.after is not None:
+            statement = statement.where(key > self.after)
+        # one extra row tells if there is a next page
+        return statement.order_by(key).limit(self.limit + 1)
+
+    def page(self, rows: List, response: Response, key: str = "id") -> List:
+        """Trim the rows of a paginated query and set the next cursor."""
+        if len(rows) > self.limit:
+            rows = rows[: self.limit]
+            response.headers["X-Next-Cursor"] = encode_cursor(
+                getattr(rows[-1], key)
+            )
+        return rows
+
+    def paginate_offset(self, statement):
+        """Page a statement that has no unique sort key, like ranked search
+        results, the cursor holds the offset of the page instead, as
+        validated by `decode_cursor`."""
+        return statement.offset(self.after or 0).limit(self.limit + 1)
+
+    def page_offset(self, rows: List, response: Response) -> List:
+        if len(rows) > self.limit:
+            rows = rows[: self.limit]
+            response.headers["X-Next-Cursor"] = encode_cursor(
+                (self.after or 0) + self.limit
+            )
+        return rows
+
+
+Paginated = Depends(Pagination)
@@ -0,0 +1,140 @@
+"""On-demand profiling of single requests, for admins.
+
+With `settings.server.profiling` enabled, a request sent with the
+`X-Profile` header or the `profile` query parameter runs under cProfile,
+once the caller passed the same checks as `AdminUser`:
+
+- `store` keeps the response and dumps the pstats file to
+  `settings.server.profiling_dir`, named in the `X-Profile-File` header,
+  readable by `python -m pstats`, snakeviz or flameprof.
+- `text` replaces the response with the pstats report of the request.
+
+cProfile records the whole event loop thread, so other requests running
+at the same time are part of the profile. When profiling is disabled the
+middleware is not installed at all.
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import time
+from urllib.parse import parse_qs
+
+from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from .config import settings
+from .security import get_current_admin_user, get_current_user
+
+PROFILE_MODES = ("store", "text")
+PROFILE_DIR = settings.get("server.profiling_dir", "profiles")
+# rows of the `text` report
+PROFILE_LIMIT = 40
+
+
+def requested_mode(scope) -> str:
+    """The profile mode asked by the request, if any."""
+    for name, value in scope["headers"]:
+        if name == b"x-profile":
+            return value.decode("latin-1")
+    if b"profile=" in scope["query_string"]:
+        query = parse_qs(scope["query_string"].decode("latin-1"))
+        return query.get("profile", [""])[0]
+    return ""
+
+
+class ProfilerMiddleware:
+    def __init__(self, app, directory: str = PROFILE_DIR):
+        self.app = app
+        self.directory = directory
+        # a second cProfile would take over the hook of the running one
+        self.active = False
+
+    async def __call__(self, scope, receive, send):
+        mode = requested_mode(scope) if scope["type"] == "http" else ""
+        if not mode:
+            await self.app(scope, receive, send)
+            return
+
+        if mode not in PROFILE_MODES:
+            response = JSONResponse(
+                {"detail": f"profile must be one of {PROFILE_MODES}"},
+                status_code=400,
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await get_current_admin_user(
+                await get_current_user(token="", request=Request(scope))
+            )
+        except HTTPException as exc:
+            response = JSONResponse(
+                {"detail": exc.detail},
+                status_code=exc.status_code,
+                headers=exc.headers,
+            )
+            await response(scope, receive, send)
+            return
+
+        if self.active:
+            response = JSONResponse(
+                {"detail": "Another request is being profiled"},
+                status_code=409,
+            )
+            await response(scope, receive, send)
+            return
+        self.active = True
+        try:
+            if mode == "text":
+                await self.report(scope, receive, send)
+            else:
+                await self.store(scope, receive, send)
+        finally:
+            self.active = False
+
+    async def store(self, scope, receive, send):
+        os.makedirs(self.directory, exist_ok=True)
+        name = "{:.6f}-{}{}.prof".format(
+            time.time(),
+            scope["method"],
+            scope["path"].replace("/", "_"),
+        )
+
+        async def send_with_file(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-profile-file", name.encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send_with_file)
+        finally:
+            profiler.disable()
+            profiler.dump_stats(os.path.join(self.directory, name))
+
+    async def report(self, scope, receive, send):
+        status = 500
+
+        async def discard(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await self.app(scope, receive, discard)
+        finally:
+            profiler.disable()
+
+        output = io.StringIO()
+        stats = pstats.Stats(profiler, stream=output)
+        stats.sort_stats("cumulative").print_stats(PROFILE_LIMIT)
+        response = PlainTextResponse(
+            output.getvalue(), headers={"X-Profiled-Status": str(status)}
+        )
+        await response(scope, receive, send)
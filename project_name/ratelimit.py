@@ -0,0 +1,133 @@
+"""Sliding window rate limits of the authentication endpoints.
+
+Every `/token` call costs a bcrypt verification, so a burst of login
+attempts keeps the worker's CPU busy for every other endpoint. The limits
+are checked, and the attempt counted, before the password is hashed:
+
+- per client ip and per username on `/token`,
+- per client ip on `/refresh_token`.
+
+Counters are kept in a SQLite file, `settings.security.rate_limit_store`,
+so the workers of a host share them. Each key has a counter per fixed
+window and the current rate weighs the previous window by the part of it
+still inside the sliding window. Rejected requests get a 429 with a
+`Retry-After` header and are not counted.
+"""
+
+import math
+import time
+from typing import Dict, Optional
+
+from fastapi import Depends, HTTPException, Request, status
+from fastapi.security import OAuth2PasswordRequestForm
+
+from .config import settings
+from .sqlitestore import SQLiteStore
+
+RATE_LIMIT = settings.security.get("rate_limit", True)
+RATE_LIMIT_WINDOW = settings.security.get("rate_limit_window", 60)
+RATE_LIMIT_PER_IP = settings.security.get("rate_limit_per_ip", 30)
+RATE_LIMIT_PER_USERNAME = settings.security.get("rate_limit_per_username", 10)
+
+
+class RateLimiter(SQLiteStore):
+    """Sliding window counters stored in the SQLite database at `path`,
+    shared by the processes using the same file."""
+
+    schema = (
+        "CREATE TABLE IF NOT EXISTS rate_limit ("
+        "key TEXT, window INTEGER, hits INTEGER, "
+        "PRIMARY KEY (key, window))"
+    )
+
+    def __init__(self, path: str, window: float = 60):
+        super().__init__(path)
+        self.window = window
+        self.pruned = -1
+
+    def hit(self, limits: Dict[str, int], now: Optional[float] = None):
+        """Count a request for every key of `limits`, a key to the number
+        of requests allowed per window, unless one is over its limit.
+
+        Returns 0 when the request is allowed, else the seconds to wait.
+        """
+        now = time.time() if now is None else now
+        window = int(now // self.window)
+        # weight of the previous window in the sliding one
+        weight = 1 - (now % self.window) / self.window
+        connection = self.connection()
+        # a write lock from the start, so workers can't both pass the
+        # last free slot
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for key, limit in limits.items():
+                counts = dict(
+                    connection.execute(
+                        "SELECT window, hits FROM rate_limit "
+                        "WHERE key = ? AND window >= ?",
+                        (key, window - 1),
+                    ).fetchall()
+                )
+                rate = counts.get(window - 1, 0) * weight + counts.get(
+                    window, 0
+                )
+                if rate >= limit:
+                    connection.execute("ROLLBACK")
+                    return math.ceil(self.window - now % self.window)
+            connection.executemany(
+                "INSERT INTO rate_limit (key, window, hits) "
+                "VALUES (?, ?, 1) ON CONFLICT (key, window) "
+                "DO UPDATE SET hits = hits + 1",
+                [(key, window) for key in limits],
+            )
+            if self.pruned != window:
+                self.pruned = window
+                connection.execute(
+                    "DELETE FROM rate_limit WHERE window < ?", (window - 1,)
+                )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return 0
+
+
+limiter = RateLimiter(
+    settings.security.get("rate_limit_store", "ratelimit.db"),
+    RATE_LIMIT_WINDOW,
+)
+
+
+def client_ip(request: Request) -> str:
+    return request.client.host if request.client else ""
+
+
+def enforce(limits: Dict[str, int]):
+    retry_after = limiter.hit(limits)
+    if retry_after:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many attempts, try again later",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+
+# sync dependencies, FastAPI runs them in the threadpool so waiting on
+# the SQLite lock doesn't block the event loop
+
+
+def login_rate_limit(
+    request: Request, form_data: OAuth2PasswordRequestForm = Depends()
+):
+    if RATE_LIMIT:
+        enforce(
+            {
+                f"token:ip:{client_ip(request)}": RATE_LIMIT_PER_IP,
+                f"token:user:{form_data.username}": RATE_LIMIT_PER_USERNAME,
+            }
+        )
+
+
+def refresh_rate_limit(request: Request):
+    if RATE_LIMIT:
+        enforce({f"refresh:ip:{client_ip(request)}": RATE_LIMIT_PER_IP})
@@ -0,0 +1,101 @@
+"""Fast JSON responses for list endpoints.
+
+When `settings.server.fast_json` is enabled the list routes convert rows
+straight to the shape of their response_model and encode them with
+orjson, skipping the validation of every item through the pydantic
+response_model and the stdlib json encoder. Install it with the `fast`
+extra, `pip install project_name[fast]`, without it the stdlib encoder is
+used and a warning is logged.
+"""
+
+import logging
+from typing import Any, Dict, Iterable, List, Optional
+
+from fastapi import Response
+from fastapi.responses import JSONResponse
+
+from .config import settings
+from .fields import USER_FIELDS
+from .models.content import Content
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore[assignment]
+
+logger = logging.getLogger(__name__)
+
+FAST_JSON = settings.server.get("fast_json", False)
+
+if FAST_JSON and orjson is None:  # pragma: no cover
+    logger.warning(
+        "fast_json is on but orjson is not installed, responses are "
+        "encoded by the stdlib json, install project_name[fast]"
+    )
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        if orjson is None:  # pragma: no cover
+            return super().render(content)
+        return orjson.dumps(content)
+
+
+def serialize_content(
+    content: Content, fields: Optional[List[str]] = None
+) -> Dict[str, Any]:
+    """The ContentResponse representation of a Content, or its `fields`."""
+    if fields is not None:
+        return {name: getattr(content, name) for name in fields}
+    return {
+        "id": content.id,
+        "title": content.title,
+        "slug": content.slug,
+        "text": content.text,
+        "published": content.published,
+        "created_time": content.created_time,
+        "tags": content.tags,
+        "user_id": content.user_id,
+    }
+
+
+def serialize_user(
+    user,
+    include_contents: bool = True,
+    fields: Optional[List[str]] = None,
+    content_fields: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """The UserResponse representation of a User, or its `fields`, with
+    the `content_fields` of its contents."""
+    data = {
+        name: getattr(user, name)
+        for name in fields or USER_FIELDS
+        if name != "contents"
+    }
+    if fields is None or "contents" in fields:
+        data["contents"] = (
+            [
+                serialize_content(content, content_fields)
+                for content in user.contents
+            ]
+            if include_contents
+            else None
+        )
+    return data
+
+
+def fast_json(items: Iterable[Dict], response: Response) -> Response:
+    """Render already serialized `items`, keeping the headers the route
+    set on its `response` (pagination cursor, validators)."""
+    content: List[Dict] = list(items)
+    return fast_json_item(content, response)
+
+
+def fast_json_item(item: Any, response: Response) -> Response:
+    """Render a single serialized item, like `fast_json`."""
+    headers = {
+        key: value
+        for key, value in response.headers.items()
+        if key != "content-length"
+    }
+    return FastJSONResponse(item, headers=headers)
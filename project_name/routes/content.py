@@ -1,105 +1,452 @@
-from typing import List, Union
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional, Set
 
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Body, Query, Request, Response
 from fastapi.exceptions import HTTPException
-from sqlmodel import Session, or_, select
+from sqlalchemy import inspect, insert
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from ..db import ActiveSession
-from ..models.content import Content, ContentIncoming, ContentResponse
-from ..security import AuthenticatedUser, User, get_current_user
+from .. import responses
+from ..conditional import (
+    content_version_columns,
+    is_conditional,
+    is_not_modified,
+    make_validators,
+    not_modified,
+    set_validators,
+)
+from ..config import settings
+from ..db import AsyncActiveSession, AsyncReadSession
+from ..export import ExportFormat, export_response
+from ..fields import ContentFields, ContentFieldset
+from ..models.content import (
+    Content,
+    ContentBulkPatch,
+    ContentBulkResult,
+    ContentIncoming,
+    ContentResponse,
+    ContentTag,
+    filter_by_tags,
+    select_contents,
+    split_tags,
+)
+from ..pagination import Paginated, Pagination
+from ..search import search_contents
+from ..security import AdminUser, AuthenticatedUser, User
+
+BULK_MAX_ITEMS = settings.bulk.max_items
 
 router = APIRouter()
 
 
+# rows per INSERT of a bulk create, keeps under the parameter limits
+BULK_INSERT_ROWS = 500
+
+# what a client can set on a content, the slug is generated from the title
+INCOMING_FIELDS = {*ContentIncoming.__fields__, "slug"}
+
+
+@asynccontextmanager
+async def slug_conflicts(session: AsyncSession):
+    """Turn a violation of the unique slug index into a 422, other
+    integrity errors are not the client's slug."""
+    try:
+        yield
+    except IntegrityError as error:
+        await session.rollback()
+        # every dialect names the column or its index
+        if "slug" not in str(error.orig):
+            raise
+        raise HTTPException(status_code=422, detail="Slug already exists")
+
+
+async def commit_content(session: AsyncSession):
+    async with slug_conflicts(session):
+        await session.commit()
+
+
+async def find_content(session: AsyncSession, id_or_slug: str, statement):
+    """Run a Content `statement` for the id or, if not found, the slug."""
+    if id_or_slug.isdigit():
+        # primary key lookup, falls back to slug for numeric slugs
+        results = await session.exec(
+            statement.where(Content.id == int(id_or_slug))
+        )
+        result = results.first()
+        if result is not None:
+            return result
+    results = await session.exec(statement.where(Content.slug == id_or_slug))
+    return results.first()
+
+
+def apply_patch(content: Content, patch: ContentIncoming):
+    """Set the fields sent in `patch`, anything else, like a `user_id`,
+    is ignored."""
+    patch_data = patch.dict(include=INCOMING_FIELDS, exclude_unset=True)
+    if "tags" in patch_data:
+        content.set_tags(patch_data.pop("tags") or [])
+    for key, value in patch_data.items():
+        setattr(content, key, value)
+    content.touch()
+
+
+def can_change(user: User, content: Content) -> bool:
+    return content.user_id == user.id or user.superuser
+
+
+async def taken_slugs(
+    session: AsyncSession, slugs: List[Optional[str]]
+) -> Set[Optional[str]]:
+    wanted = [slug for slug in slugs if slug]
+    if not wanted:
+        return set()
+    taken = await session.execute(
+        select(Content.slug).where(col(Content.slug).in_(wanted))
+    )
+    return set(taken.scalars())
+
+
+def new_content(content: ContentIncoming, user: User) -> Content:
+    """A Content of `user` from the fields of `content`, anything else
+    sent, like an `id`, is ignored."""
+    db_content = Content(
+        **content.dict(include=INCOMING_FIELDS, exclude={"tags"}),
+        user_id=user.id,
+    )
+    db_content.set_tags(content.tags or [])
+    return db_content
+
+
+async def insert_contents(session: AsyncSession, contents: List[Content]):
+    """Insert new `contents` and their tags with multi-row INSERTs, the
+    ORM sends one INSERT per content to get its id back.
+
+    The ids are read back by slug, slugs are unique.
+    """
+    columns = inspect(Content).column_attrs
+    for start in range(0, len(contents), BULK_INSERT_ROWS):
+        end = start + BULK_INSERT_ROWS
+        batch = contents[start:end]
+        await session.execute(
+            insert(Content).values(
+                [
+                    {
+                        attr.columns[0].key: getattr(content, attr.key)
+                        for attr in columns
+                        if attr.key != "id"
+                    }
+                    for content in batch
+                ]
+            )
+        )
+        ids = await session.execute(
+            select(Content.slug, Content.id).where(
+                col(Content.slug).in_([content.slug for content in batch])
+            )
+        )
+        id_by_slug = {row.slug: row.id for row in ids}
+        tags: List[dict] = []
+        for content in batch:
+            content.id = id_by_slug[content.slug]
+            tags.extend(
+                {"content_id": content.id, "name": tag, "position": position}
+                for position, tag in enumerate(content.tags)
+            )
+        if tags:
+            await session.execute(insert(ContentTag).values(tags))
+
+
+def bulk_results(results: List) -> List[ContentBulkResult]:
+    """Turn the Content or (id, status, detail) of each item to results."""
+    return [
+        (
+            ContentBulkResult(
+                id=result.id,
+                status=200,
+                detail=None,
+                content=ContentResponse.from_orm(result),
+            )
+            if isinstance(result, Content)
+            else ContentBulkResult(
+                id=result[0], status=result[1], detail=result[2], content=None
+            )
+        )
+        for result in results
+    ]
+
+
 @router.get("/", response_model=List[ContentResponse])
-async def list_contents(*, session: Session = ActiveSession):
-    contents = session.exec(select(Content)).all()
+async def list_contents(
+    *,
+    session: AsyncSession = AsyncReadSession,
+    request: Request,
+    response: Response,
+    pagination: Pagination = Paginated,
+    fields: ContentFields = ContentFieldset,
+    tag: Optional[str] = None,
+    tags_any: Optional[List[str]] = Query(None),
+    tags_all: Optional[List[str]] = Query(None),
+):
+    filters: Dict[str, Any] = dict(
+        tag=tag,
+        # accepts both `?tags_any=a&tags_any=b` and `?tags_any=a,b`
+        tags_any=split_tags(",".join(tags_any or [])),
+        tags_all=split_tags(",".join(tags_all or [])),
+    )
+    if is_conditional(request):
+        versions = await session.exec(
+            pagination.paginate(
+                filter_by_tags(select(*content_version_columns()), **filters),
+                Content.id,
+            )
+        )
+        validators = make_validators(versions.all(), str(request.url))
+        if is_not_modified(request, validators):
+            return not_modified(validators)
+
+    statement = filter_by_tags(select_contents(fields.fields), **filters)
+    contents = (
+        await session.exec(pagination.paginate(statement, Content.id))
+    ).all()
+    validators = make_validators(
+        [(c.id, c.modified_time) for c in contents], str(request.url)
+    )
+    set_validators(response, validators)
+    contents = pagination.page(contents, response)
+    if responses.FAST_JSON or fields.fields is not None:
+        return responses.fast_json(
+            (
+                responses.serialize_content(content, fields.fields)
+                for content in contents
+            ),
+            response,
+        )
     return contents
 
 
+@router.get("/search", response_model=List[ContentResponse])
+async def search(
+    *,
+    q: str = Query(..., min_length=1),
+    session: AsyncSession = AsyncReadSession,
+    response: Response,
+    pagination: Pagination = Paginated,
+    fields: ContentFields = ContentFieldset,
+):
+    """Full-text search on title and text, best matches first."""
+    if not q.strip():
+        return []
+    statement = search_contents(
+        select_contents(fields.fields), q, session.bind.dialect.name
+    )
+    results = await session.exec(pagination.paginate_offset(statement))
+    contents = pagination.page_offset(results.all(), response)
+    if fields.fields is not None:
+        return responses.fast_json(
+            (
+                responses.serialize_content(content, fields.fields)
+                for content in contents
+            ),
+            response,
+        )
+    return contents
+
+
+@router.get("/export", dependencies=[AdminUser])
+async def export_contents(*, format: str = ExportFormat):
+    """Stream all the contents as NDJSON, or a JSON array."""
+    return export_response("content", format)
+
+
+@router.post("/bulk", response_model=List[ContentBulkResult])
+async def create_contents(
+    *,
+    session: AsyncSession = AsyncActiveSession,
+    user: User = AuthenticatedUser,
+    contents: List[ContentIncoming] = Body(..., max_items=BULK_MAX_ITEMS),
+):
+    """Create many contents in a single transaction."""
+    slugs = await taken_slugs(
+        session, [getattr(content, "slug", None) for content in contents]
+    )
+    results: List = []
+    created: List[Content] = []
+    for content in contents:
+        slug = getattr(content, "slug", None)
+        if not content.title or content.text is None:
+            results.append((None, 422, "title and text are required"))
+            continue
+        if slug in slugs:
+            results.append((None, 422, "Slug already exists"))
+            continue
+        slugs.add(slug)
+        created.append(new_content(content, user))
+        results.append(created[-1])
+    async with slug_conflicts(session):
+        await insert_contents(session, created)
+        await session.commit()
+    return bulk_results(results)
+
+
+@router.patch("/bulk", response_model=List[ContentBulkResult])
+async def update_contents(
+    *,
+    session: AsyncSession = AsyncActiveSession,
+    user: User = AuthenticatedUser,
+    patches: List[ContentBulkPatch] = Body(..., max_items=BULK_MAX_ITEMS),
+):
+    """Update many contents in a single transaction."""
+    contents = await session.exec(
+        select_contents().where(col(Content.id).in_([p.id for p in patches]))
+    )
+    by_id = {content.id: content for content in contents.all()}
+    slugs = await taken_slugs(
+        session, [getattr(patch, "slug", None) for patch in patches]
+    )
+    results: List = []
+    for patch in patches:
+        content = by_id.get(patch.id)
+        slug = getattr(patch, "slug", None)
+        if content is None:
+            results.append((patch.id, 404, "Content not found"))
+        elif not can_change(user, content):
+            results.append((patch.id, 403, "You don't own this content"))
+        elif slug and slug != content.slug and slug in slugs:
+            results.append((patch.id, 422, "Slug already exists"))
+        else:
+            if slug:
+                slugs.discard(content.slug)
+                slugs.add(slug)
+            apply_patch(content, patch)
+            results.append(content)
+    await commit_content(session)
+    return bulk_results(results)
+
+
+@router.delete("/bulk", response_model=List[ContentBulkResult])
+async def delete_contents(
+    *,
+    session: AsyncSession = AsyncActiveSession,
+    user: User = AuthenticatedUser,
+    ids: List[int] = Body(..., max_items=BULK_MAX_ITEMS),
+):
+    """Delete many contents in a single transaction."""
+    contents = await session.exec(
+        select_contents().where(col(Content.id).in_(ids))
+    )
+    by_id = {content.id: content for content in contents.all()}
+    results: List = []
+    for content_id in ids:
+        content = by_id.pop(content_id, None)
+        if content is None:
+            results.append((content_id, 404, "Content not found"))
+        elif not can_change(user, content):
+            results.append((content_id, 403, "You don't own this content"))
+        else:
+            await session.delete(content)
+            results.append((content_id, 200, None))
+    await session.commit()
+    return bulk_results(results)
+
+
 @router.get("/{id_or_slug}/", response_model=ContentResponse)
 async def query_content(
-    *, id_or_slug: Union[str, int], session: Session = ActiveSession
+    *,
+    id_or_slug: str,
+    session: AsyncSession = AsyncReadSession,
+    request: Request,
+    response: Response,
+    fields: ContentFields = ContentFieldset,
 ):
-    content = session.query(Content).where(
-        or_(
-            Content.id == id_or_slug,
-            Content.slug == id_or_slug,
+    if is_conditional(request):
+        version = await find_content(
+            session, id_or_slug, select(*content_version_columns())
         )
+        if version is not None:
+            validators = make_validators([version], *fields.validators())
+            if is_not_modified(request, validators):
+                return not_modified(validators)
+
+    content = await find_content(
+        session, id_or_slug, select_contents(fields.fields)
     )
     if not content:
         raise HTTPException(status_code=404, detail="Content not found")
-    return content.first()
+    set_validators(
+        response,
+        make_validators(
+            [(content.id, content.modified_time)], *fields.validators()
+        ),
+    )
+    if fields.fields is not None:
+        return responses.fast_json_item(
+            responses.serialize_content(content, fields.fields), response
+        )
+    return content
 
 
-@router.post(
-    "/", response_model=ContentResponse, dependencies=[AuthenticatedUser]
-)
+@router.post("/", response_model=ContentResponse)
 async def create_content(
     *,
-    session: Session = ActiveSession,
-    request: Request,
+    session: AsyncSession = AsyncActiveSession,
+    user: User = AuthenticatedUser,
     content: ContentIncoming,
 ):
     # set the ownsership of the content to the current user
-    db_content = Content.from_orm(content)
-    user: User = get_current_user(request=request)
-    db_content.user_id = user.id
+    db_content = new_content(content, user)
     session.add(db_content)
-    session.commit()
-    session.refresh(db_content)
+    await commit_content(session)
     return db_content
 
 
-@router.patch(
-    "/{content_id}/",
-    response_model=ContentResponse,
-    dependencies=[AuthenticatedUser],
-)
+@router.patch("/{content_id}/", response_model=ContentResponse)
 async def update_content(
     *,
     content_id: int,
-    session: Session = ActiveSession,
-    request: Request,
+    session: AsyncSession = AsyncActiveSession,
+    current_user: User = AuthenticatedUser,
     patch: ContentIncoming,
 ):
     # Query the content
-    content = session.get(Content, content_id)
+    contents = await session.exec(
+        select_contents().where(Content.id == content_id)
+    )
+    content = contents.first()
     if not content:
         raise HTTPException(status_code=404, detail="Content not found")
 
     # Check the user owns the content
-    current_user: User = get_current_user(request=request)
-    if content.user_id != current_user.id and not current_user.superuser:
+    if not can_change(current_user, content):
         raise HTTPException(
             status_code=403, detail="You don't own this content"
         )
 
     # Update the content
-    patch_data = patch.dict(exclude_unset=True)
-    for key, value in patch_data.items():
-        setattr(content, key, value)
+    apply_patch(content, patch)
 
     # Commit the session
-    session.commit()
-    session.refresh(content)
+    await commit_content(session)
     return content
 
 
-@router.delete("/{content_id}/", dependencies=[AuthenticatedUser])
-def delete_content(
-    *, session: Session = ActiveSession, request: Request, content_id: int
+@router.delete("/{content_id}/")
+async def delete_content(
+    *,
+    session: AsyncSession = AsyncActiveSession,
+    current_user: User = AuthenticatedUser,
+    content_id: int,
 ):
 
-    content = session.get(Content, content_id)
+    content = await session.get(Content, content_id)
     if not content:
         raise HTTPException(status_code=404, detail="Content not found")
     # Check the user owns the content
-    current_user = get_current_user(request=request)
     if content.user_id != current_user.id and not current_user.superuser:
         raise HTTPException(
             status_code=403, detail="You don't own this content"
         )
-    session.delete(content)
-    session.commit()
+    await session.delete(content)
+    await session.commit()
     return {"ok": True}
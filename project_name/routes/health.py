@@ -0,0 +1,18 @@
+from fastapi import APIRouter
+
+from ..db import pool_metrics
+from ..security import password_hasher, user_cache
+
+router = APIRouter()
+
+
+@router.get("/health")
+async def health():
+    return {
+        "status": "ok",
+        "db": {
+            name: metrics.stats() for name, metrics in pool_metrics.items()
+        },
+        "user_cache": user_cache.stats(),
+        "password_hasher": password_hasher.stats(),
+    }
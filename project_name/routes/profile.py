@@ -1,10 +1,112 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends, Request, Response
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
+from ..conditional import (
+    content_version_columns,
+    is_conditional,
+    is_not_modified,
+    make_validators,
+    not_modified,
+    set_validators,
+)
+from .. import responses
+from ..db import get_read_engine
+from ..fields import UserFields, UserFieldset
+from ..models.content import Content
 from ..security import AuthenticatedUser, User, UserResponse
+from .user import select_users, user_response
 
 router = APIRouter()
 
 
+async def get_profile_session(
+    request: Request, current_user: User = AuthenticatedUser
+):
+    """A read session on the primary while the token or the user itself
+    were written recently, e.g. a user just created by an admin."""
+    engine = get_read_engine(
+        request.headers.get("authorization"),
+        f"user:{current_user.username}",
+    )
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        yield session
+
+
+def profile_validators(
+    user: User, versions, include_contents: bool, fields: UserFields
+):
+    return make_validators(
+        versions,
+        user.id,
+        user.username,
+        user.disabled,
+        user.superuser,
+        include_contents,
+        *fields.validators(),
+    )
+
+
+def profile_response(
+    user: User, include_contents: bool, fields: UserFields, response
+):
+    if fields.fields is None:
+        return user_response(user, include_contents)
+    return responses.fast_json_item(
+        responses.serialize_user(
+            user, include_contents, fields.fields, fields.content_fields
+        ),
+        response,
+    )
+
+
 @router.get("/profile", response_model=UserResponse)
-async def my_profile(current_user: User = AuthenticatedUser):
-    return current_user
+async def my_profile(
+    request: Request,
+    response: Response,
+    current_user: User = AuthenticatedUser,
+    session: AsyncSession = Depends(get_profile_session),
+    include_contents: bool = True,
+    fields: UserFields = UserFieldset,
+):
+    include_contents = include_contents and fields.contents
+    if not include_contents:
+        validators = profile_validators(
+            current_user, [], include_contents, fields
+        )
+        if is_not_modified(request, validators):
+            return not_modified(validators)
+        set_validators(response, validators)
+        return profile_response(
+            current_user, include_contents, fields, response
+        )
+
+    if is_conditional(request):
+        versions = await session.exec(
+            select(*content_version_columns()).where(
+                Content.user_id == current_user.id
+            )
+        )
+        validators = profile_validators(
+            current_user, versions.all(), include_contents, fields
+        )
+        if is_not_modified(request, validators):
+            return not_modified(validators)
+
+    # all the columns of the user, the validators read them
+    users = await session.exec(
+        select_users(content_fields=fields.content_fields).where(
+            User.id == current_user.id
+        )
+    )
+    user = users.one()
+    set_validators(
+        response,
+        profile_validators(
+            user,
+            [(c.id, c.modified_time) for c in user.contents],
+            include_contents,
+            fields,
+        ),
+    )
+    return profile_response(user, include_contents, fields, response)
@@ -4,6 +4,7 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 
 from ..config import settings
+from ..ratelimit import login_rate_limit, refresh_rate_limit
 from ..security import (
     RefreshToken,
     Token,
@@ -11,7 +12,8 @@ from ..security import (
     authenticate_user,
     create_access_token,
     create_refresh_token,
-    get_user,
+    load_user,
+    user_cache,
     validate_token,
 )
 
@@ -21,17 +23,26 @@ REFRESH_TOKEN_EXPIRE_MINUTES = settings.security.refresh_token_expire_minutes
 router = APIRouter()
 
 
-@router.post("/token", response_model=Token)
+@router.post(
+    "/token",
+    response_model=Token,
+    dependencies=[Depends(login_rate_limit)],
+)
 async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
 ):
-    user = authenticate_user(get_user, form_data.username, form_data.password)
+    # not from `user_cache`, it may hold a previous password
+    user = await authenticate_user(
+        load_user, form_data.username, form_data.password
+    )
     if not user or not isinstance(user, User):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    # just read, the token is resolved without a query
+    user_cache.set(user.username, user)
 
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
@@ -51,7 +62,11 @@ async def login_for_access_token(
     }
 
 
-@router.post("/refresh_token", response_model=Token)
+@router.post(
+    "/refresh_token",
+    response_model=Token,
+    dependencies=[Depends(refresh_rate_limit)],
+)
 async def refresh_token(form_data: RefreshToken):
     user = await validate_token(token=form_data.refresh_token)
 
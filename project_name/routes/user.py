@@ -1,10 +1,17 @@
-from typing import List, Union
+from typing import List, Optional, Union
 
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Response
 from fastapi.exceptions import HTTPException
-from sqlmodel import Session, or_, select
-
-from ..db import ActiveSession
+from sqlalchemy.orm import load_only, noload
+from sqlmodel import col, or_, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from .. import responses
+from ..db import AsyncActiveSession, AsyncReadSession
+from ..export import ExportFormat, export_response
+from ..fields import UserFields, UserFieldset
+from ..models.content import content_options
+from ..pagination import Paginated, Pagination
 from ..security import (
     AdminUser,
     AuthenticatedFreshUser,
@@ -13,56 +20,138 @@ from ..security import (
     UserCreate,
     UserPasswordPatch,
     UserResponse,
-    get_current_user,
-    get_password_hash,
+    password_hasher,
 )
 
 router = APIRouter()
 
 
+def select_users(
+    include_contents: bool = True,
+    fields: Optional[List[str]] = None,
+    content_fields: Optional[List[str]] = None,
+):
+    """Select users with their contents loaded, as required by UserResponse.
+
+    The contents of all the selected users are loaded by a single
+    additional query, so the number of queries doesn't grow with the
+    number of users. Without `include_contents` they are not loaded at all.
+    With `fields`, and `content_fields` of the contents, only the columns
+    they need are loaded.
+    """
+    statement = select(User)
+    if fields is not None:
+        names = {"id"} | set(fields) - {"contents"}
+        statement = statement.options(
+            load_only(*(getattr(User, name) for name in sorted(names)))
+        )
+        include_contents = include_contents and "contents" in fields
+    if not include_contents:
+        return statement.options(noload(User.contents))
+    return statement.options(
+        *content_options(content_fields, parent=User.contents)
+    )
+
+
+def user_response(
+    user: User,
+    include_contents: bool = True,
+    fields: Optional[List[str]] = None,
+    content_fields: Optional[List[str]] = None,
+):
+    """Leave `contents` out of the response when they were not loaded."""
+    if fields is not None:
+        return responses.FastJSONResponse(
+            responses.serialize_user(
+                user, include_contents, fields, content_fields
+            )
+        )
+    if include_contents:
+        return user
+    return UserResponse(**user.dict(), contents=None)
+
+
 @router.get("/", response_model=List[UserResponse], dependencies=[AdminUser])
-async def list_users(*, session: Session = ActiveSession):
-    users = session.exec(select(User)).all()
-    return users
+async def list_users(
+    *,
+    session: AsyncSession = AsyncActiveSession,
+    response: Response,
+    pagination: Pagination = Paginated,
+    include_contents: bool = True,
+    fields: UserFields = UserFieldset,
+):
+    results = await session.exec(
+        pagination.paginate(
+            select_users(
+                include_contents, fields.fields, fields.content_fields
+            ),
+            User.id,
+        )
+    )
+    users = pagination.page(results.all(), response)
+    if responses.FAST_JSON or fields.fields is not None:
+        return responses.fast_json(
+            (
+                responses.serialize_user(
+                    user,
+                    include_contents,
+                    fields.fields,
+                    fields.content_fields,
+                )
+                for user in users
+            ),
+            response,
+        )
+    return [user_response(user, include_contents) for user in users]
+
+
+@router.get("/export", dependencies=[AdminUser])
+async def export_users(*, format: str = ExportFormat):
+    """Stream all the users, without their contents, as NDJSON or a JSON
+    array."""
+    return export_response("users", format)
 
 
 @router.post("/", response_model=UserResponse, dependencies=[AdminUser])
-async def create_user(*, session: Session = ActiveSession, user: UserCreate):
+async def create_user(
+    *, session: AsyncSession = AsyncActiveSession, user: UserCreate
+):
 
     # verify user with username doesn't already exist
     try:
-        await query_user(session=session, user_id_or_username=user.username)
+        await query_user(
+            session=session,
+            user_id_or_username=user.username,
+            fields=UserFields(None),
+        )
     except HTTPException:
         pass
     else:
         raise HTTPException(status_code=422, detail="Username already exists")
 
-    db_user = User.from_orm(user)
+    password = await password_hasher.hash(user.password)
+    db_user = User(**user.dict(exclude={"password"}), password=password)
     session.add(db_user)
-    session.commit()
-    session.refresh(db_user)
-    return db_user
+    await session.commit()
+    users = await session.exec(select_users().where(User.id == db_user.id))
+    return users.one()
 
 
-@router.patch(
-    "/{user_id}/password/",
-    response_model=UserResponse,
-    dependencies=[AuthenticatedFreshUser],
-)
+@router.patch("/{user_id}/password/", response_model=UserResponse)
 async def update_user_password(
     *,
     user_id: int,
-    session: Session = ActiveSession,
-    request: Request,
+    session: AsyncSession = AsyncActiveSession,
+    current_user: User = AuthenticatedFreshUser,
     patch: UserPasswordPatch,
 ):
     # Query the content
-    user = session.get(User, user_id)
+    users = await session.exec(select_users().where(User.id == user_id))
+    user = users.first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
     # Check the user can update the password
-    current_user: User = get_current_user(request=request)
     if user.id != current_user.id and not current_user.superuser:
         raise HTTPException(
             status_code=403, detail="You can't update this user password"
@@ -72,11 +161,10 @@ async def update_user_password(
         raise HTTPException(status_code=400, detail="Passwords don't match")
 
     # Update the password
-    user.password = get_password_hash(patch.password)
+    user.password = await password_hasher.hash(patch.password)
 
     # Commit the session
-    session.commit()
-    session.refresh(user)
+    await session.commit()
     return user
 
 
@@ -86,33 +174,45 @@ async def update_user_password(
     dependencies=[AuthenticatedUser],
 )
 async def query_user(
-    *, session: Session = ActiveSession, user_id_or_username: Union[str, int]
+    *,
+    session: AsyncSession = AsyncReadSession,
+    user_id_or_username: Union[str, int],
+    include_contents: bool = True,
+    fields: UserFields = UserFieldset,
 ):
-    user = session.query(User).where(
-        or_(
-            User.id == user_id_or_username,
-            User.username == user_id_or_username,
+    users = await session.exec(
+        select_users(
+            include_contents, fields.fields, fields.content_fields
+        ).where(
+            or_(
+                col(User.id) == user_id_or_username,
+                col(User.username) == user_id_or_username,
+            )
         )
     )
-
-    if not user.first():
+    user = users.first()
+    if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    return user.first()
+    return user_response(
+        user, include_contents, fields.fields, fields.content_fields
+    )
 
 
-@router.delete("/{user_id}/", dependencies=[AdminUser])
-def delete_user(
-    *, session: Session = ActiveSession, request: Request, user_id: int
+@router.delete("/{user_id}/")
+async def delete_user(
+    *,
+    session: AsyncSession = AsyncActiveSession,
+    current_user: User = AdminUser,
+    user_id: int,
 ):
-    user = session.get(User, user_id)
+    user = await session.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="Content not found")
     # Check the user is not deleting himself
-    current_user = get_current_user(request=request)
     if user.id == current_user.id:
         raise HTTPException(
             status_code=403, detail="You can't delete yourself"
         )
-    session.delete(user)
-    session.commit()
+    await session.delete(user)
+    await session.commit()
     return {"ok": True}
@@ -0,0 +1,91 @@
+"""Full-text search over `Content.title` and `Content.text`.
+
+SQLite uses an external content FTS5 table and Postgres a generated
+tsvector column with a GIN index. Both are kept in sync by the database
+itself, so every insert, update and delete of contents is indexed.
+"""
+
+from sqlalchemy import bindparam, column, func, literal_column, table, text
+
+from .models.content import Content
+
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE content_fts USING fts5("
+    "title, text, content='content', content_rowid='id')",
+    # title matches rank higher than text matches
+    "INSERT INTO content_fts(content_fts, rank) "
+    "VALUES ('rank', 'bm25(10.0, 1.0)')",
+    "INSERT INTO content_fts(content_fts) VALUES ('rebuild')",
+    "CREATE TRIGGER content_fts_insert AFTER INSERT ON content BEGIN "
+    "INSERT INTO content_fts(rowid, title, text) "
+    "VALUES (new.id, new.title, new.text); END",
+    "CREATE TRIGGER content_fts_delete AFTER DELETE ON content BEGIN "
+    "INSERT INTO content_fts(content_fts, rowid, title, text) "
+    "VALUES ('delete', old.id, old.title, old.text); END",
+    "CREATE TRIGGER content_fts_update AFTER UPDATE OF title, text "
+    "ON content BEGIN "
+    "INSERT INTO content_fts(content_fts, rowid, title, text) "
+    "VALUES ('delete', old.id, old.title, old.text); "
+    "INSERT INTO content_fts(rowid, title, text) "
+    "VALUES (new.id, new.title, new.text); END",
+]
+
+POSTGRES_DDL = [
+    "ALTER TABLE content ADD COLUMN IF NOT EXISTS search_vector tsvector "
+    "GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(text, '')), 'B')) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_content_search_vector "
+    "ON content USING GIN (search_vector)",
+]
+
+content_fts = table(
+    "content_fts", column("rowid"), column("rank"), column("content_fts")
+)
+
+
+def create_search_index(engine):
+    """Create the full-text index of contents, indexing existing rows."""
+    with engine.begin() as connection:
+        if connection.dialect.name == "sqlite":
+            exists = connection.execute(
+                text(
+                    "SELECT 1 FROM sqlite_master "
+                    "WHERE type = 'table' AND name = 'content_fts'"
+                )
+            ).first()
+            statements = [] if exists else SQLITE_DDL
+        elif connection.dialect.name == "postgresql":
+            statements = POSTGRES_DDL
+        else:  # pragma: no cover
+            statements = []
+        for statement in statements:
+            connection.execute(text(statement))
+
+
+def fts5_query(query: str) -> str:
+    """Quote every term so user input can't break the FTS5 query syntax.
+    >>> fts5_query("fast api*")
+    '"fast" "api*"'
+    """
+    terms = (term.replace('"', '""') for term in query.split())
+    return " ".join(f'"{term}"' for term in terms)
+
+
+def search_contents(statement, query: str, dialect: str):
+    """Restrict a Content select to the matches of `query`, best first."""
+    if dialect == "postgresql":
+        vector = literal_column("content.search_vector")
+        tsquery = func.websearch_to_tsquery("english", query)
+        return statement.where(vector.op("@@")(tsquery)).order_by(
+            func.ts_rank(vector, tsquery).desc(), Content.id
+        )
+    return (
+        statement.join(content_fts, content_fts.c.rowid == Content.id)
+        .where(
+            content_fts.c.content_fts.match(
+                bindparam("fts_query", fts5_query(query))
+            )
+        )
+        .order_by(content_fts.c.rank, Content.id)
+    )
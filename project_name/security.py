@@ -1,3 +1,7 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Callable, List, Optional, Union
 
@@ -6,12 +10,16 @@ from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from pydantic import BaseModel
-from sqlmodel import Field, Relationship, Session, SQLModel
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+from sqlmodel import Field, Relationship, SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from project_name.models.content import Content, ContentResponse
 
+from .cache import TTLCache
 from .config import settings
-from .db import engine
+from .db import get_read_engine, remember_write
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
@@ -19,6 +27,14 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 SECRET_KEY = settings.security.secret_key
 ALGORITHM = settings.security.algorithm
 
+# Users of the tokens by username, saves a query on every request. Login
+# reads the database, a password changed or a user disabled on another
+# worker is seen at once there, here after at most `user_cache_ttl`.
+user_cache = TTLCache(
+    maxsize=settings.security.get("user_cache_size", 1024),
+    ttl=settings.security.get("user_cache_ttl", 60),
+)
+
 
 class Token(BaseModel):
     access_token: str
@@ -58,6 +74,10 @@ class HashedPassword(str):
         if not isinstance(v, str):
             raise TypeError("string required")
 
+        if isinstance(v, cls):
+            # already hashed, e.g: by `password_hasher`
+            return v
+
         hashed_password = get_password_hash(v)
         # you could also return a string here which would mean model.password
         # would be a string, pydantic won't care but you could end up with some
@@ -77,6 +97,32 @@ class User(SQLModel, table=True):
     contents: List["Content"] = Relationship(back_populates="user")
 
 
+@event.listens_for(User, "after_insert")
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def invalidate_cached_user(mapper, connection, target):
+    """Drop changed users (password, disabled, ...) from `user_cache`.
+
+    The entries are dropped again after commit, in case a concurrent
+    request cached the previous row before the transaction ended.
+    """
+    usernames = {target.username}
+    usernames.update(inspect(target).attrs.username.history.deleted)
+    for username in usernames:
+        user_cache.pop(username)
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("stale_usernames", set()).update(usernames)
+
+
+@event.listens_for(Session, "after_commit")
+def invalidate_committed_users(session):
+    for username in session.info.pop("stale_usernames", ()):
+        user_cache.pop(username)
+        # `load_user` reads them from the primary until replicas caught up
+        remember_write(f"user:{username}")
+
+
 class UserResponse(BaseModel):
     """This is the User model to be used as a response_model
     it doesn't include the password.
@@ -113,6 +159,66 @@ def get_password_hash(password) -> str:
     return pwd_context.hash(password)
 
 
+class PasswordHasher:
+    """Runs bcrypt hashing and verification on a bounded thread pool.
+
+    bcrypt releases the GIL, so the event loop keeps serving other
+    requests while at most `max_workers` hashes run and the rest queue.
+    """
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="password-hasher"
+        )
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.queue_time = 0.0
+        self.max_queue_time = 0.0
+
+    async def run(self, func: Callable, *args):
+        queued = time.perf_counter()
+
+        def call():
+            self.record_queue_time(time.perf_counter() - queued)
+            return func(*args)
+
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, call
+            )
+        finally:
+            self.pending -= 1
+            self.completed += 1
+
+    def record_queue_time(self, elapsed: float):
+        with self.lock:
+            self.queue_time += elapsed
+            self.max_queue_time = max(self.max_queue_time, elapsed)
+
+    async def hash(self, password: str) -> HashedPassword:
+        return HashedPassword(await self.run(get_password_hash, password))
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self.run(verify_password, plain_password, hashed_password)
+
+    def stats(self) -> dict:
+        return {
+            "max_workers": self.max_workers,
+            "pending": self.pending,
+            "completed": self.completed,
+            "queue_time_total": round(self.queue_time, 6),
+            "queue_time_max": round(self.max_queue_time, 6),
+        }
+
+
+password_hasher = PasswordHasher(
+    max_workers=settings.security.get("password_hash_workers", 4)
+)
+
+
 def create_access_token(
     data: dict, expires_delta: Optional[timedelta] = None
 ) -> str:
@@ -139,23 +245,49 @@ def create_refresh_token(
     return encoded_jwt
 
 
-def authenticate_user(
+async def authenticate_user(
     get_user: Callable, username: str, password: str
 ) -> Union[User, bool]:
-    user = get_user(username)
+    user = await get_user(username)
     if not user:
         return False
-    if not verify_password(password, user.password):
+    if not await password_hasher.verify(password, user.password):
         return False
     return user
 
 
-def get_user(username) -> Optional[User]:
-    with Session(engine) as session:
-        return session.query(User).where(User.username == username).first()
+async def load_user(username) -> Optional[User]:
+    """The user read from the database, bypassing `user_cache`."""
+    async with AsyncSession(get_read_engine(f"user:{username}")) as session:
+        users = await session.execute(
+            select(User).where(User.username == username)
+        )
+        return users.scalars().first()
+
+
+def copy_user(user: User) -> User:
+    """A transient copy, requests don't share the cached instance."""
+    return User(
+        id=user.id,
+        username=user.username,
+        # already hashed, not hashed again
+        password=HashedPassword(user.password),
+        superuser=user.superuser,
+        disabled=user.disabled,
+    )
+
+
+async def get_user(username) -> Optional[User]:
+    user = user_cache.get(username)
+    if user is None:
+        user = await load_user(username)
+        if user is None:
+            return None
+        user_cache.set(username, user)
+    return copy_user(user)
 
 
-def get_current_user(
+async def get_current_user(
     token: str = Depends(oauth2_scheme), request: Request = None, fresh=False
 ) -> User:
     credentials_exception = HTTPException(
@@ -164,13 +296,30 @@ def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
 
+    principal = None
     if request:
         if authorization := request.headers.get("authorization"):
             try:
                 token = authorization.split(" ")[1]
             except IndexError:
                 raise credentials_exception
+        # resolved by a previous dependency or middleware of the request
+        principal = getattr(request.state, "principal", None)
+
+    if principal is not None and principal[0] == token:
+        _, payload, user = principal
+    else:
+        payload, user = await resolve_token(token, credentials_exception)
+        if request:
+            request.state.principal = (token, payload, user)
+    if fresh and (not payload["fresh"] and not user.superuser):
+        raise credentials_exception
 
+    return user
+
+
+async def resolve_token(token: str, credentials_exception: HTTPException):
+    """The claims of `token` and the user they name."""
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
@@ -180,13 +329,10 @@ def get_current_user(
         token_data = TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    user = get_user(username=token_data.username)
+    user = await get_user(username=token_data.username)
     if user is None:
         raise credentials_exception
-    if fresh and (not payload["fresh"] and not user.superuser):
-        raise credentials_exception
-
-    return user
+    return payload, user
 
 
 async def get_current_active_user(
@@ -200,10 +346,10 @@ async def get_current_active_user(
 AuthenticatedUser = Depends(get_current_active_user)
 
 
-def get_current_fresh_user(
+async def get_current_fresh_user(
     token: str = Depends(oauth2_scheme), request: Request = None
 ) -> User:
-    return get_current_user(token, request, True)
+    return await get_current_user(token, request, True)
 
 
 AuthenticatedFreshUser = Depends(get_current_fresh_user)
@@ -224,5 +370,5 @@ AdminUser = Depends(get_current_admin_user)
 
 async def validate_token(token: str = Depends(oauth2_scheme)) -> User:
 
-    user = get_current_user(token=token)
+    user = await get_current_user(token=token)
     return user
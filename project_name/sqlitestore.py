@@ -0,0 +1,37 @@
+"""SQLite files the worker processes of a host share, e.g. the rate limit
+counters and the recent writers of the read replicas."""
+
+import os
+import sqlite3
+import threading
+
+
+class SQLiteStore:
+    """A SQLite database at `path` in WAL mode, created with `schema` on
+    first use. Every thread, and every forked process, has its own
+    connection."""
+
+    schema = ""
+
+    def __init__(self, path: str):
+        # relative to the directory the app started from
+        self.path = os.path.abspath(path)
+        # sqlite3 connections can't be shared between threads
+        self.local = threading.local()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self.reset)
+
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self.path, timeout=5, isolation_level=None
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(self.schema)
+            self.local.connection = connection
+        return connection
+
+    def reset(self):
+        """Forget the connections, e.g. in a forked process."""
+        self.local = threading.local()
@@ -0,0 +1,129 @@
+"""Per-request SQL instrumentation.
+
+Engine events count the queries of the current request and their time,
+reported in a `Server-Timing` header and on /metrics. A SELECT repeated
+`settings.db.n_plus_one_threshold` times in one request is logged as a
+probable N+1, and fails the request in strict mode (the testing env), so
+the test suite catches them.
+"""
+
+import logging
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import List, Optional, Tuple
+
+from sqlalchemy import event
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+N_PLUS_ONE_THRESHOLD = settings.get("db.n_plus_one_threshold", 5)
+N_PLUS_ONE_STRICT = settings.get("db.n_plus_one_strict", False)
+
+
+class NPlusOneError(Exception):
+    """Raised in strict mode by requests repeating the same SELECT."""
+
+
+class QueryTrace:
+    """The queries run while handling one request."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.selects: Counter = Counter()
+        self.n_plus_one: List[Tuple[str, int]] = []
+
+    def record(self, statement: str, elapsed: float):
+        self.count += 1
+        self.duration += elapsed
+        if statement.lstrip()[:6].upper() == "SELECT":
+            self.selects[statement] += 1
+
+    def repeated(self, threshold: int) -> List[Tuple[str, int]]:
+        return [
+            (statement, count)
+            for statement, count in self.selects.items()
+            if count >= threshold
+        ]
+
+    def server_timing(self) -> str:
+        return f'db;dur={self.duration * 1000:.3f};desc="{self.count} queries"'
+
+
+current_trace: ContextVar[Optional[QueryTrace]] = ContextVar(
+    "current_trace", default=None
+)
+
+
+def before_cursor_execute(conn, cursor, statement, params, context, many):
+    if current_trace.get() is not None:
+        context._trace_start = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, params, context, many):
+    trace = current_trace.get()
+    start = getattr(context, "_trace_start", None)
+    if trace is not None and start is not None:
+        trace.record(statement, time.perf_counter() - start)
+
+
+def instrument(engine):
+    """Record the queries of `engine` in request traces, a sync Engine or
+    the Engine class for every engine, even those not created yet."""
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+
+
+class QueryTraceMiddleware:
+    def __init__(
+        self,
+        app,
+        threshold: int = N_PLUS_ONE_THRESHOLD,
+        strict: bool = N_PLUS_ONE_STRICT,
+    ):
+        self.app = app
+        self.threshold = threshold
+        self.strict = strict
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # MetricsMiddleware reads it back from the scope
+        trace = scope["query_trace"] = QueryTrace()
+
+        async def send_with_timing(message):
+            # queries of streamed bodies run after this, they are only
+            # part of the metrics
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append(
+                    (b"server-timing", trace.server_timing().encode())
+                )
+                message = {**message, "headers": headers}
+            await send(message)
+
+        token = current_trace.set(trace)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_trace.reset(token)
+
+        trace.n_plus_one = trace.repeated(self.threshold)
+        for statement, count in trace.n_plus_one:
+            logger.warning(
+                "Probable N+1 on %s %s, ran %s times: %s",
+                scope["method"],
+                scope["path"],
+                count,
+                statement,
+            )
+        if trace.n_plus_one and self.strict:
+            raise NPlusOneError(
+                f"{scope['method']} {scope['path']} repeated "
+                f"{trace.n_plus_one}"
+            )
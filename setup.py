@@ -42,5 +42,9 @@ setup(
     entry_points={
         "console_scripts": ["project_name = project_name.__main__:main"]
     },
-    extras_require={"test": read_requirements("requirements-test.txt")},
+    extras_require={
+        "test": read_requirements("requirements-test.txt"),
+        # the encoder of `settings.server.fast_json`
+        "fast": ["orjson"],
+    },
 )
@@ -3,6 +3,7 @@ import sys
 import pytest
 from fastapi.testclient import TestClient
 from typer.testing import CliRunner
+from sqlalchemy import event
 from sqlalchemy.exc import IntegrityError
 
 # This next line ensures tests uses its own database and settings environment
@@ -62,20 +63,43 @@ def api_client_authenticated():
     return client
 
 
+@pytest.fixture(scope="function")
+def queries():
+    """Collects the (statement, parameters) the API runs during a test."""
+    statements = []
+
+    def collect(conn, cursor, statement, parameters, *args):
+        statements.append((statement, parameters))
+
+    engine = db.async_engine.sync_engine
+    event.listen(engine, "before_cursor_execute", collect)
+    yield statements
+    event.remove(engine, "before_cursor_execute", collect)
+
+
 @pytest.fixture(scope="function")
 def cli_client():
     return CliRunner()
 
 
 def remove_db():
-    # Remove the database file
-    try:
-        os.remove("testing.db")
-    except FileNotFoundError:
-        pass
+    # Remove the database files, with the WAL files of the shared stores
+    for database in (
+        "testing.db",
+        "testing_ratelimit.db",
+        "testing_writers.db",
+    ):
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.remove(database + suffix)
+            except FileNotFoundError:
+                pass
 
 
 @pytest.fixture(scope="session", autouse=True)
 def initialize_db(request):
-    db.create_db_and_tables(db.engine)
+    # engines are lazy, SQLite resolves relative paths when they are
+    # created, so create them before the tests change directories
+    db.create_db_and_tables(db.get_engine())
+    db.get_async_engine()
     request.addfinalizer(remove_db)
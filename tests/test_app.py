@@ -1,3 +1,6 @@
+import os
+
+
 def test_using_testing_db(settings):
     assert settings.db.uri == "sqlite:///testing.db"
 
@@ -38,3 +41,81 @@ def test_cors_header(api_client):
 
     for res in invalid_responses:
         assert res.headers.get("access-control-allow-origin") is None
+
+
+def test_health(api_client):
+    response = api_client.get("/health")
+    assert response.status_code == 200
+    result = response.json()
+    assert result["status"] == "ok"
+    assert set(result["db"]) == {"engine", "async_engine"}
+    for stats in result["db"].values():
+        assert stats["in_use"] >= 0
+        assert stats["timeouts"] == 0
+
+
+def test_metrics(api_client):
+    api_client.get("/content/1/")
+    api_client.get("/content/does-not-exist/")
+    api_client.get("/nowhere")
+
+    response = api_client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    lines = response.text.splitlines()
+    worker = f'worker="{os.getpid()}"'
+    route = f'{worker},method="GET",route="/content/{{id_or_slug}}/"'
+    assert f'http_requests_total{{{route},status="404"}}' in "\n".join(lines)
+    assert any(
+        line.startswith(
+            f'http_request_duration_seconds_bucket{{{route},le="+Inf"}}'
+        )
+        for line in lines
+    )
+    assert 'route="<unmatched>",status="404"' in response.text
+    # the /metrics request itself is in flight
+    assert f"http_requests_in_progress{{{worker}}} 1" in lines
+
+
+def test_metrics_histogram():
+    from project_name.metrics import RequestMetrics
+
+    metrics = RequestMetrics(buckets=[0.1, 1])
+    for elapsed in (0.05, 0.1, 0.5, 2):
+        metrics.observe("GET", "/", 200, elapsed)
+    lines = metrics.render().splitlines()
+    labels = f'worker="{os.getpid()}",method="GET",route="/"'
+    assert (
+        f'http_request_duration_seconds_bucket{{{labels},le="0.1"}} 2' in lines
+    )
+    assert (
+        f'http_request_duration_seconds_bucket{{{labels},le="1"}} 3' in lines
+    )
+    assert f"http_request_duration_seconds_count{{{labels}}} 4" in lines
+    assert f'http_requests_total{{{labels},status="200"}} 4' in lines
+
+
+def test_profile_request(api_client_authenticated, api_client):
+    import os
+    import pstats
+
+    response = api_client.get("/", headers={"X-Profile": "text"})
+    assert response.status_code == 401
+    response = api_client_authenticated.get("/", params={"profile": "x"})
+    assert response.status_code == 400
+
+    response = api_client_authenticated.get("/", params={"profile": "text"})
+    assert response.status_code == 200
+    assert response.headers["X-Profiled-Status"] == "200"
+    assert "function calls" in response.text
+
+    response = api_client_authenticated.get(
+        "/content/", headers={"X-Profile": "store"}
+    )
+    assert response.status_code == 200
+    assert isinstance(response.json(), list)
+    path = os.path.join("profiles", response.headers["X-Profile-File"])
+    assert pstats.Stats(path).total_calls > 0
+
+    response = api_client_authenticated.get("/")
+    assert "X-Profile-File" not in response.headers
@@ -1,3 +1,9 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+
 import pytest
 
 given = pytest.mark.parametrize
@@ -36,3 +42,287 @@ def test_cmds(cli_client, cli, cmd, args, msg):
     result = cli_client.invoke(cli, [cmd, *args])
     assert result.exit_code == 0
     assert msg in result.stdout
+
+
+def test_migrate_tags(cli_client, cli):
+    from sqlmodel import Session
+
+    from project_name.db import engine
+    from project_name.models.content import Content, migrate_legacy_tags
+
+    legacy = {"legacy-1": "a,b", "legacy-2": "c", "legacy-3": "d"}
+    with Session(engine) as session:
+        contents = [
+            Content(title=slug, slug=slug, text="t", legacy_tags=tags)
+            for slug, tags in legacy.items()
+        ]
+        session.add_all(contents)
+        session.commit()
+        content_ids = [content.id for content in contents]
+        # more contents than a batch
+        assert migrate_legacy_tags(session, batch_size=2) == 3
+
+        content = session.get(Content, content_ids[0])
+        assert content.tags == ["a", "b"]
+        assert content.legacy_tags == ""
+        content.legacy_tags = "e"
+        session.commit()
+
+    # updating the database migrates them
+    result = cli_client.invoke(cli, ["create-db"])
+    assert result.exit_code == 0
+    assert "migrated tags of 1 contents" in result.stdout
+    result = cli_client.invoke(cli, ["migrate-tags"])
+    assert result.exit_code == 0
+    assert "migrated tags of 0 contents" in result.stdout
+
+    with Session(engine) as session:
+        contents = [session.get(Content, id) for id in content_ids]
+        assert [content.tags for content in contents] == [
+            ["a", "b", "e"],
+            ["c"],
+            ["d"],
+        ]
+        for content in contents:
+            session.delete(content)
+        session.commit()
+
+
+def test_import_users(cli_client, cli):
+    with open("users.csv", "w") as users:
+        users.write("username,password,superuser\n")
+        users.write("imported1,pass1,true\n")
+        users.write("imported2,pass2,false\n")
+        users.write("imported1,again,false\n")
+        users.write(",nouser,false\n")
+
+    result = cli_client.invoke(
+        cli, ["import-users", "users.csv", "--batch-size", "2"]
+    )
+    assert result.exit_code == 0, result.output
+    assert "2 imported, 1 duplicates, 1 invalid" in result.stdout
+    assert "skipped duplicate username imported1" in result.output
+
+    with open("users.jsonl", "w") as users:
+        users.write('{"username": "imported2", "password": "x"}\n')
+        users.write('{"username": "imported3", "password": "pass3"}\n')
+
+    result = cli_client.invoke(
+        cli, ["import-users", "users.jsonl", "--workers", "1"]
+    )
+    assert result.exit_code == 0, result.output
+    assert "1 imported, 1 duplicates" in result.stdout
+
+    login = cli_client.invoke(cli, ["import-users", "--help"])
+    assert "--batch-size" in login.stdout
+
+
+def test_export(cli_client, cli):
+    from project_name.cli import create_user
+
+    for number in range(1, 4):
+        create_user(f"exported{number}", "password")
+    result = cli_client.invoke(
+        cli, ["export", "users", "--batch-size", "2", "--output", "u.ndjson"]
+    )
+    assert result.exit_code == 0, result.output
+    with open("u.ndjson") as exported:
+        users = [json.loads(line) for line in exported]
+    usernames = {user["username"] for user in users}
+    assert {"exported1", "exported2", "exported3"} <= usernames
+    assert all("password" not in user for user in users)
+    assert len({user["id"] for user in users}) == len(users)
+
+    result = cli_client.invoke(cli, ["export", "content", "--format", "json"])
+    assert result.exit_code == 0, result.output
+    assert isinstance(json.loads(result.stdout), list)
+
+    result = cli_client.invoke(cli, ["export", "nothing"])
+    assert result.exit_code != 0
+
+
+def test_bench(cli_client, cli, tmp_path):
+    database = str(tmp_path / "bench.db")
+    args = ["bench", "--users", "2", "--contents", "5", "--requests", "3"]
+    args += ["--concurrency", "2", "--mode", "inprocess"]
+    args += ["--database", database]
+    result = cli_client.invoke(cli, args + ["--output", "bench.json"])
+    assert result.exit_code == 0, result.output
+    with open("bench.json") as output:
+        results = json.load(output)["results"]["inprocess"]
+    assert set(results) == {
+        "login",
+        "list",
+        "get_by_slug",
+        "create",
+        "patch",
+        "profile",
+    }
+    for flow in results.values():
+        assert flow["requests"] == 3
+        assert flow["errors"] == 0
+        assert flow["p50_ms"] <= flow["p95_ms"] <= flow["p99_ms"]
+
+    # the seeded database is reused, only what is missing is added
+    args = ["bench", "--users", "4", "--contents", "8", "--requests", "1"]
+    args += ["--mode", "inprocess", "--flow", "list"]
+    result = cli_client.invoke(cli, args + ["--database", database])
+    assert result.exit_code == 0, result.output
+    with sqlite3.connect(database) as connection:
+        users = connection.execute(
+            "SELECT count(*) FROM user WHERE username LIKE 'bench%'"
+        ).fetchone()
+        contents = connection.execute(
+            "SELECT count(*) FROM content WHERE slug LIKE 'bench-content-%'"
+        ).fetchone()
+        tags = connection.execute(
+            "SELECT count(*) FROM contenttag WHERE name = 'bench'"
+        ).fetchone()
+    assert (users[0], contents[0], tags[0]) == (4, 8, 8)
+
+    result = cli_client.invoke(cli, ["bench", "--flow", "nothing"])
+    assert result.exit_code != 0
+
+
+def run_python(*args, **environ):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = {**os.environ, **environ, "PYTHONPATH": root}
+    return subprocess.run(
+        [sys.executable, *args], env=env, capture_output=True, check=True
+    )
+
+
+def test_cli_import_is_lazy():
+    heavy = ("fastapi", "sqlalchemy", "uvicorn", "passlib", "httpx")
+    result = run_python(
+        "-c",
+        "import sys, project_name.cli; "
+        f"print([name for name in {heavy} if name in sys.modules])",
+    )
+    assert result.stdout.decode().strip() == "[]"
+
+    # nor does --help, it used to build the app
+    result = run_python(
+        "-c",
+        "import sys, typer, project_name.cli\n"
+        "try:\n"
+        "    typer.main.get_command(project_name.cli.cli)(['--help'])\n"
+        "except SystemExit:\n"
+        "    pass\n"
+        f"print([name for name in {heavy} if name in sys.modules])",
+    )
+    output = result.stdout.decode()
+    assert "create-db" in output
+    assert output.strip().splitlines()[-1] == "[]"
+
+
+def test_create_db(cli_client, cli):
+    result = cli_client.invoke(cli, ["create-db"])
+    assert result.exit_code == 0, result.output
+    assert "database is up to date" in result.stdout
+
+
+def test_create_db_in_a_new_process(tmp_path):
+    # this process imported every model already, a new one has not
+    path = tmp_path / "new.db"
+    result = run_python(
+        "-m",
+        "project_name",
+        "create-db",
+        PROJECT_NAME_DB__uri=f"sqlite:///{path}",
+    )
+    assert "database is up to date" in result.stdout.decode()
+    with sqlite3.connect(path) as connection:
+        tables = {
+            name
+            for name, in connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'"
+            )
+        }
+    assert {"user", "content", "contenttag"} <= tables
+
+
+@given(
+    "args,expected",
+    [
+        (["--workers", "4"], {"workers": 4, "limit_max_requests": None}),
+        (
+            ["--workers", "2", "--max-requests", "1000"],
+            {"workers": 2, "limit_max_requests": 1000},
+        ),
+        # recycling needs the supervisor of several workers
+        (
+            ["--workers", "1", "--max-requests", "1000"],
+            {"workers": 1, "limit_max_requests": None},
+        ),
+        (["--reload"], {"workers": 1, "reload": True}),
+        (["--keep-alive", "30"], {"timeout_keep_alive": 30}),
+    ],
+)
+def test_run_options(cli_client, cli, monkeypatch, args, expected):
+    import uvicorn
+
+    # restored after the test, run sets it for the workers
+    monkeypatch.setenv("PROJECT_NAME_DB__create_on_startup", "true")
+    calls = []
+    monkeypatch.setattr(uvicorn, "run", lambda *a, **kw: calls.append(kw))
+    result = cli_client.invoke(cli, ["run", *args])
+    assert result.exit_code == 0, result.output
+    assert expected.items() <= calls[0].items()
+
+
+def test_run_defaults_to_a_worker_per_cpu(cli_client, cli, monkeypatch):
+    import uvicorn
+
+    # restored after the test, run sets it for the workers
+    monkeypatch.setenv("PROJECT_NAME_DB__create_on_startup", "true")
+    calls = []
+    monkeypatch.setattr(uvicorn, "run", lambda *a, **kw: calls.append(kw))
+    result = cli_client.invoke(cli, ["run"])
+    assert result.exit_code == 0, result.output
+    assert calls[0]["workers"] == (os.cpu_count() or 1)
+
+
+RUN_WITHOUT_SERVER = (
+    "import os, sys, typer, uvicorn, project_name.cli\n"
+    "uvicorn.run = lambda *args, **kwargs: print(\n"
+    "    os.environ.get('PROJECT_NAME_DB__create_on_startup'))\n"
+    "typer.main.get_command(project_name.cli.cli)(\n"
+    "    ['run', *sys.argv[1:]], standalone_mode=False)\n"
+)
+
+
+def test_run_creates_the_database_before_the_workers(tmp_path):
+    # a new process, as in production, with nothing imported yet
+    path = tmp_path / "new.db"
+    uri = f"sqlite:///{path}"
+    result = run_python(
+        "-c", RUN_WITHOUT_SERVER, "--workers", "1", PROJECT_NAME_DB__uri=uri
+    )
+    # the single worker creates it on startup
+    assert result.stdout.decode().strip() == "None"
+    assert not path.exists()
+
+    result = run_python(
+        "-c", RUN_WITHOUT_SERVER, "--workers", "2", PROJECT_NAME_DB__uri=uri
+    )
+    # the workers inherit it and skip their startup DDL
+    assert result.stdout.decode().strip() == "false"
+    with sqlite3.connect(path) as connection:
+        tables = {
+            name
+            for name, in connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'"
+            )
+        }
+    assert {"user", "content", "contenttag"} <= tables
+
+
+def test_run_reload_warns_of_explicit_workers(cli_client, cli, monkeypatch):
+    import uvicorn
+
+    monkeypatch.setattr(uvicorn, "run", lambda *a, **kw: None)
+    result = cli_client.invoke(cli, ["run", "--reload"])
+    assert "--reload runs a single worker" not in result.output
+    result = cli_client.invoke(cli, ["run", "--reload", "--workers", "4"])
+    assert "--reload runs a single worker" in result.output
@@ -0,0 +1,85 @@
+import zlib
+
+import pytest
+from fastapi.responses import PlainTextResponse, StreamingResponse
+
+from project_name.compression import CompressionMiddleware, negotiate
+
+from .utils import run_asgi
+
+given = pytest.mark.parametrize
+
+
+@given(
+    "accept_encoding,expected",
+    [
+        ("gzip, deflate", "gzip"),
+        ("gzip;q=0.5, br", "br"),
+        ("br;q=0.5, zstd;q=0.5, gzip;q=0.5", "zstd"),
+        ("gzip;q=0", ""),
+        ("*", "zstd"),
+        ("identity", ""),
+        ("", ""),
+    ],
+)
+def test_negotiate(accept_encoding, expected):
+    assert negotiate(accept_encoding, ["zstd", "br", "gzip"]) == expected
+
+
+def test_compress_large_responses(api_client):
+    response = api_client.get(
+        "/openapi.json", headers={"Accept-Encoding": "gzip"}
+    )
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+    # decoded by the client
+    assert response.json()["info"]["title"] == "project_name"
+    assert int(response.headers["content-length"]) < len(response.content)
+
+
+@given(
+    "path,headers",
+    [
+        ("/health", {"Accept-Encoding": "gzip"}),
+        ("/openapi.json", {"Accept-Encoding": "identity"}),
+    ],
+)
+def test_skip_compression(api_client, path, headers):
+    response = api_client.get(path, headers=headers)
+    assert response.status_code == 200
+    assert "content-encoding" not in response.headers
+
+
+def test_compress_streams_incrementally():
+    chunks = [f"line {number}\n".encode() * 10 for number in range(3)]
+
+    async def stream():
+        for chunk in chunks:
+            yield chunk
+
+    app = CompressionMiddleware(
+        StreamingResponse(stream(), media_type="application/x-ndjson"),
+        content_types=["application/x-ndjson"],
+    )
+    messages = run_asgi(app, headers=[(b"accept-encoding", b"gzip")])
+
+    headers = dict(messages[0]["headers"])
+    assert headers[b"content-encoding"] == b"gzip"
+    assert b"content-length" not in headers
+    decompressor = zlib.decompressobj(31)
+    bodies = [message["body"] for message in messages[1:]]
+    # every chunk can be decoded as soon as it arrives
+    for chunk, body in zip(chunks, bodies):
+        assert decompressor.decompress(body) == chunk
+    # the last message ends the gzip stream
+    assert decompressor.decompress(bodies[-1]) == b""
+    assert decompressor.eof
+
+
+def test_skip_content_types():
+    app = CompressionMiddleware(
+        PlainTextResponse("x" * 2000), content_types=["application/json"]
+    )
+    messages = run_asgi(app, headers=[(b"accept-encoding", b"gzip")])
+    assert b"content-encoding" not in dict(messages[0]["headers"])
+    assert messages[1]["body"] == b"x" * 2000
@@ -1,3 +1,11 @@
+import asyncio
+import json
+import math
+import re
+
+from project_name.pagination import encode_cursor
+
+
 def test_content_create(api_client_authenticated):
     response = api_client_authenticated.post(
         "/content/",
@@ -18,3 +26,462 @@ def test_content_list(api_client_authenticated):
     assert response.status_code == 200
     result = response.json()
     assert result[0]["slug"] == "hello-test"
+
+
+def test_content_list_pagination(api_client_authenticated):
+    for i in range(3):
+        api_client_authenticated.post(
+            "/content/",
+            json={"title": f"page {i}", "text": "paginated", "tags": ["p"]},
+        )
+    ids = [c["id"] for c in api_client_authenticated.get("/content/").json()]
+
+    seen = []
+    cursor = None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        response = api_client_authenticated.get("/content/", params=params)
+        assert response.status_code == 200
+        assert len(response.json()) <= 2
+        seen.extend(c["id"] for c in response.json())
+        cursor = response.headers.get("x-next-cursor")
+        if not cursor:
+            break
+    assert seen == sorted(ids)
+
+
+def test_content_list_page_cap(api_client, settings):
+    limit = settings.pagination.max_page_size + 1
+    response = api_client.get("/content/", params={"limit": limit})
+    assert response.status_code == 422
+
+    response = api_client.get("/content/", params={"cursor": "bogus"})
+    assert response.status_code == 400
+
+
+def test_content_list_invalid_cursor(api_client):
+    for key in ["a", -1, 1.5, True, None, [1]]:
+        cursor = encode_cursor(key)
+        response = api_client.get("/content/", params={"cursor": cursor})
+        assert response.status_code == 400, key
+        assert response.json()["detail"] == "Invalid cursor"
+
+
+def test_content_search_invalid_cursor(api_client):
+    # search pages by offset, which must not be negative nor a string
+    for key in ["a", -1]:
+        response = api_client.get(
+            "/content/search", params={"q": "x", "cursor": encode_cursor(key)}
+        )
+        assert response.status_code == 400, key
+
+
+def test_content_filter_by_tags(api_client_authenticated):
+    for title, tags in [
+        ("tagged a", ["alpha"]),
+        ("tagged ab", ["alpha", "beta"]),
+        ("tagged c", "gamma, alpha"),
+    ]:
+        response = api_client_authenticated.post(
+            "/content/", json={"title": title, "text": "t", "tags": tags}
+        )
+        assert response.status_code == 200
+    assert response.json()["tags"] == ["gamma", "alpha"]
+
+    def titles(**params):
+        response = api_client_authenticated.get("/content/", params=params)
+        assert response.status_code == 200
+        return {content["title"] for content in response.json()}
+
+    assert titles(tag="beta") == {"tagged ab"}
+    assert titles(tags_any=["beta", "gamma"]) == {"tagged ab", "tagged c"}
+    assert titles(tags_any="beta,gamma") == {"tagged ab", "tagged c"}
+    assert titles(tags_all=["alpha", "beta"]) == {"tagged ab"}
+    assert titles(tag="alpha", tags_all="alpha,gamma") == {"tagged c"}
+
+
+def test_content_update_tags(api_client_authenticated):
+    response = api_client_authenticated.post(
+        "/content/", json={"title": "retag", "text": "t", "tags": ["old"]}
+    )
+    content_id = response.json()["id"]
+
+    response = api_client_authenticated.patch(
+        f"/content/{content_id}/", json={"tags": ["new", "newer"]}
+    )
+    assert response.status_code == 200
+    assert response.json()["tags"] == ["new", "newer"]
+
+    response = api_client_authenticated.get("/content/", params={"tag": "old"})
+    assert content_id not in [content["id"] for content in response.json()]
+
+
+def test_content_search(api_client_authenticated):
+    for title, text in [
+        ("searching pythons", "a snake story"),
+        ("a story", "about pythons and a snake"),
+        ("unrelated", "nothing to see"),
+    ]:
+        response = api_client_authenticated.post(
+            "/content/", json={"title": title, "text": text, "tags": ["s"]}
+        )
+    unrelated_id = response.json()["id"]
+
+    response = api_client_authenticated.get(
+        "/content/search", params={"q": "pythons snake"}
+    )
+    assert response.status_code == 200
+    # title matches rank first
+    assert [c["title"] for c in response.json()] == [
+        "searching pythons",
+        "a story",
+    ]
+
+    response = api_client_authenticated.get(
+        "/content/search", params={"q": "pythons", "limit": 1}
+    )
+    assert len(response.json()) == 1
+    response = api_client_authenticated.get(
+        "/content/search",
+        params={"q": "pythons", "cursor": response.headers["x-next-cursor"]},
+    )
+    assert [c["title"] for c in response.json()] == ["a story"]
+
+    # the index follows updates and deletes
+    api_client_authenticated.patch(
+        f"/content/{unrelated_id}/", json={"text": "pythons again"}
+    )
+    response = api_client_authenticated.get(
+        "/content/search", params={"q": "again"}
+    )
+    assert [c["id"] for c in response.json()] == [unrelated_id]
+    api_client_authenticated.delete(f"/content/{unrelated_id}/")
+    response = api_client_authenticated.get(
+        "/content/search", params={"q": "again"}
+    )
+    assert response.json() == []
+
+    response = api_client_authenticated.get(
+        "/content/search", params={"q": 'bad "syntax AND'}
+    )
+    assert response.status_code == 200
+
+
+def query_plan(statement, parameters):
+    from project_name.db import engine
+
+    with engine.connect() as connection:
+        rows = connection.exec_driver_sql(
+            f"EXPLAIN QUERY PLAN {statement}", tuple(parameters)
+        ).all()
+    return " ".join(row[-1] for row in rows)
+
+
+def test_content_query_plans(api_client_authenticated, queries):
+    response = api_client_authenticated.post(
+        "/content/", json={"title": "plan me", "text": "t", "tags": ["p"]}
+    )
+    content_id = response.json()["id"]
+
+    def content_queries(path):
+        queries.clear()
+        response = api_client_authenticated.get(path)
+        assert response.status_code == 200
+        assert response.json()["id"] == content_id
+        return [
+            (statement, parameters)
+            for statement, parameters in queries
+            if re.search(r"FROM content\s", statement)
+        ]
+
+    (by_id,) = content_queries(f"/content/{content_id}/")
+    assert "USING INTEGER PRIMARY KEY" in query_plan(*by_id)
+
+    (by_slug,) = content_queries("/content/plan-me/")
+    plan = query_plan(*by_slug)
+    assert "USING INDEX ix_content_slug" in plan
+    assert "SCAN content" not in plan
+
+
+def test_content_slug_is_unique(api_client_authenticated):
+    response = api_client_authenticated.post(
+        "/content/", json={"title": "same title", "text": "t", "tags": ["u"]}
+    )
+    assert response.status_code == 200
+    response = api_client_authenticated.post(
+        "/content/", json={"title": "Same Title", "text": "t", "tags": ["u"]}
+    )
+    assert response.status_code == 422
+
+    response = api_client_authenticated.get("/content/no-such-slug/")
+    assert response.status_code == 404
+
+
+def test_content_conditional_get(api_client_authenticated, queries):
+    response = api_client_authenticated.post(
+        "/content/", json={"title": "etag me", "text": "t", "tags": ["e"]}
+    )
+    content_id = response.json()["id"]
+
+    response = api_client_authenticated.get(f"/content/{content_id}/")
+    etag = response.headers["etag"]
+    last_modified = response.headers["last-modified"]
+
+    queries.clear()
+    response = api_client_authenticated.get(
+        "/content/etag-me/", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 304
+    assert response.content == b""
+    # only the version was read, not the row nor its tags
+    assert not [s for s, _ in queries if "contenttag" in s]
+
+    response = api_client_authenticated.get(
+        f"/content/{content_id}/", headers={"If-Modified-Since": last_modified}
+    )
+    assert response.status_code == 304
+
+    response = api_client_authenticated.get("/content/")
+    list_etag = response.headers["etag"]
+    response = api_client_authenticated.get(
+        "/content/", headers={"If-None-Match": list_etag}
+    )
+    assert response.status_code == 304
+
+    api_client_authenticated.patch(
+        f"/content/{content_id}/", json={"tags": ["changed"]}
+    )
+    response = api_client_authenticated.get(
+        f"/content/{content_id}/", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    response = api_client_authenticated.get(
+        "/content/", headers={"If-None-Match": list_etag}
+    )
+    assert response.status_code == 200
+
+
+def test_content_list_fast_json(api_client_authenticated, monkeypatch):
+    from project_name import responses
+
+    response = api_client_authenticated.get("/content/", params={"limit": 5})
+    monkeypatch.setattr(responses, "FAST_JSON", True)
+    fast_response = api_client_authenticated.get(
+        "/content/", params={"limit": 5}
+    )
+    assert fast_response.status_code == 200
+    assert fast_response.json() == response.json()
+    assert fast_response.headers["etag"] == response.headers["etag"]
+    assert fast_response.headers["x-next-cursor"]
+
+
+def test_content_bulk(api_client_authenticated, settings):
+    response = api_client_authenticated.post(
+        "/content/bulk",
+        json=[
+            {"title": "bulk one", "text": "t", "tags": ["bulk"]},
+            {"title": "bulk two", "text": "t", "tags": ["bulk"]},
+            {"title": "bulk one", "text": "duplicated slug"},
+            {"text": "no title"},
+        ],
+    )
+    assert response.status_code == 200
+    results = response.json()
+    assert [r["status"] for r in results] == [200, 200, 422, 422]
+    one, two = results[0]["id"], results[1]["id"]
+    assert results[0]["content"]["tags"] == ["bulk"]
+
+    response = api_client_authenticated.patch(
+        "/content/bulk",
+        json=[
+            {"id": one, "tags": ["patched"]},
+            {"id": two, "title": "bulk one"},
+            {"id": 424242, "text": "missing"},
+        ],
+    )
+    results = response.json()
+    assert [r["status"] for r in results] == [200, 422, 404]
+    assert results[0]["content"]["tags"] == ["patched"]
+
+    response = api_client_authenticated.request(
+        "DELETE", "/content/bulk", json=[one, two, 424242]
+    )
+    assert [r["status"] for r in response.json()] == [200, 200, 404]
+    assert api_client_authenticated.get(f"/content/{one}/").status_code == 404
+
+    too_many = [{"title": "x", "text": "x"}] * (settings.bulk.max_items + 1)
+    response = api_client_authenticated.post("/content/bulk", json=too_many)
+    assert response.status_code == 422
+
+
+def test_content_bulk_create_batches_inserts(
+    api_client_authenticated, queries
+):
+    response = api_client_authenticated.post(
+        "/content/bulk",
+        json=[
+            {"title": f"batched {i}", "text": "t", "tags": ["a", "b"]}
+            for i in range(5)
+        ]
+        # fields other than those of a content are ignored
+        + [{"title": "batched id", "text": "t", "id": 1}],
+    )
+    assert response.status_code == 200
+    results = response.json()
+    assert [r["status"] for r in results] == [200] * 6
+    assert results[-1]["id"] != 1
+    assert results[0]["content"]["tags"] == ["a", "b"]
+    for result in results:
+        content = api_client_authenticated.get(f"/content/{result['id']}/")
+        assert content.json() == result["content"]
+
+    inserts = [
+        statement for statement, _ in queries if statement.startswith("INSERT")
+    ]
+    assert len(inserts) == 2
+    assert inserts[0].startswith("INSERT INTO content ")
+    assert inserts[1].startswith("INSERT INTO contenttag ")
+
+    response = api_client_authenticated.request(
+        "DELETE", "/content/bulk", json=[r["id"] for r in results]
+    )
+    assert response.status_code == 200
+
+
+def test_content_create_ignores_unknown_fields(api_client_authenticated):
+    response = api_client_authenticated.post(
+        "/content/", json={"title": "with id", "text": "t", "id": 1}
+    )
+    assert response.status_code == 200
+    content_id = response.json()["id"]
+    assert content_id != 1
+    api_client_authenticated.delete(f"/content/{content_id}/")
+
+
+def test_content_patch_ignores_unknown_fields(api_client_authenticated):
+    response = api_client_authenticated.post(
+        "/content/", json={"title": "patched owner", "text": "t"}
+    )
+    content = response.json()
+    sneaky = {
+        "text": "patched",
+        "user_id": content["user_id"] + 1000,
+        "created_time": "2000-01-01T00:00:00",
+        "legacy_tags": "x",
+    }
+    response = api_client_authenticated.patch(
+        f"/content/{content['id']}/", json=sneaky
+    )
+    assert response.status_code == 200
+    response = api_client_authenticated.patch(
+        "/content/bulk", json=[{"id": content["id"], **sneaky}]
+    )
+    assert response.json()[0]["status"] == 200
+
+    patched = api_client_authenticated.get(f"/content/{content['id']}/")
+    assert patched.json()["text"] == "patched"
+    assert patched.json()["user_id"] == content["user_id"]
+    assert patched.json()["created_time"] == content["created_time"]
+    assert patched.json()["tags"] == []
+    api_client_authenticated.delete(f"/content/{content['id']}/")
+
+
+def test_content_bulk_ownership(api_client_authenticated, api_client):
+    response = api_client_authenticated.post(
+        "/content/bulk", json=[{"title": "admin owned", "text": "t"}]
+    )
+    content_id = response.json()[0]["id"]
+
+    api_client_authenticated.post(
+        "/user/", json={"username": "bulker", "password": "bulker"}
+    )
+    token = api_client.post(
+        "/token", data={"username": "bulker", "password": "bulker"}
+    ).json()["access_token"]
+    api_client.headers["Authorization"] = f"Bearer {token}"
+
+    response = api_client.patch(
+        "/content/bulk", json=[{"id": content_id, "text": "mine now"}]
+    )
+    assert response.json()[0]["status"] == 403
+    response = api_client.request("DELETE", "/content/bulk", json=[content_id])
+    assert response.json()[0]["status"] == 403
+
+
+def test_content_export(api_client_authenticated, api_client):
+    response = api_client.get("/content/export")
+    assert response.status_code == 401
+
+    listed = api_client_authenticated.get(
+        "/content/", params={"limit": 100}
+    ).json()
+    response = api_client_authenticated.get("/content/export")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = response.text.splitlines()
+    exported = [json.loads(line) for line in lines]
+    assert exported[: len(listed)] == listed
+
+    response = api_client_authenticated.get(
+        "/content/export", params={"format": "json"}
+    )
+    assert response.json() == exported
+
+    response = api_client_authenticated.get(
+        "/content/export", params={"format": "xml"}
+    )
+    assert response.status_code == 422
+
+
+def test_content_export_batches(api_client_authenticated):
+    from project_name.export import stream_export
+
+    async def chunks():
+        return [chunk async for chunk in stream_export("content", "json", 2)]
+
+    exported = api_client_authenticated.get(
+        "/content/export", params={"format": "json"}
+    ).json()
+    # one chunk per batch of 2 rows, between the array brackets
+    result = asyncio.run(chunks())
+    assert len(result) == 2 + math.ceil(len(exported) / 2)
+    assert json.loads(b"".join(result)) == exported
+
+
+def test_content_sparse_fields(api_client_authenticated, queries):
+    client = api_client_authenticated
+    content = client.post(
+        "/content/",
+        json={"title": "sparse fields", "text": "long " * 100, "tags": "a"},
+    ).json()
+
+    queries.clear()
+    response = client.get("/content/", params={"fields": "slug,id,title"})
+    assert response.status_code == 200
+    listed = {item["id"]: item for item in response.json()}
+    assert listed[content["id"]] == {
+        "id": content["id"],
+        "title": "sparse fields",
+        "slug": "sparse-fields",
+    }
+    # text isn't selected, nor the tags loaded
+    statements = [statement for statement, _ in queries]
+    assert not any("content.text" in s for s in statements)
+    assert not any("contenttag" in s for s in statements)
+
+    response = client.get(
+        f"/content/{content['id']}/", params={"fields": "tags,text"}
+    )
+    assert response.json() == {"tags": ["a"], "text": "long " * 100}
+    full = client.get(f"/content/{content['id']}/")
+    assert full.headers["ETag"] != response.headers["ETag"]
+    assert full.json() == content
+
+    response = client.get(
+        "/content/search", params={"q": "sparse", "fields": "id"}
+    )
+    assert response.json() == [{"id": content["id"]}]
+
+    response = client.get("/content/", params={"fields": "id,password"})
+    assert response.status_code == 400
@@ -0,0 +1,237 @@
+import os
+import re
+import time
+
+import pytest
+
+from project_name.db import get_async_uri
+
+from .utils import run_asgi
+
+given = pytest.mark.parametrize
+
+
+@given(
+    "uri,expected",
+    [
+        ("sqlite:///testing.db", "sqlite+aiosqlite:///testing.db"),
+        ("postgresql://u:p@db/app", "postgresql+asyncpg://u:p@db/app"),
+        ("postgresql+psycopg2://db/app", "postgresql+asyncpg://db/app"),
+        ("mysql+aiomysql://db/app", "mysql+aiomysql://db/app"),
+    ],
+)
+def test_get_async_uri(uri, expected):
+    assert get_async_uri(uri) == expected
+
+
+def test_pool_metrics_track_checkouts():
+    from sqlalchemy import create_engine
+    from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+    from sqlalchemy.pool import QueuePool
+
+    from project_name.db import PoolMetrics
+
+    engine = create_engine(
+        "sqlite://",
+        poolclass=QueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.1,
+    )
+    metrics = PoolMetrics(engine)
+
+    with engine.connect():
+        assert metrics.stats()["in_use"] == 1
+        assert metrics.stats()["size"] == 1
+    stats = metrics.stats()
+    assert stats["in_use"] == 0
+    assert stats["checkouts"] == 1
+    assert stats["wait_time_max"] >= 0
+
+    engine.dispose()
+    with engine.connect():
+        pass
+    assert metrics.stats()["checkouts"] == 2
+
+    # fails when the private hook of the pinned SQLAlchemy is gone
+    with engine.connect():
+        with pytest.raises(PoolTimeoutError):
+            engine.connect()
+    assert metrics.stats()["timeouts"] == 1
+    assert metrics.stats()["wait_time_max"] >= 0.1
+
+
+def test_forked_process_gets_new_pools():
+    from project_name import db
+
+    engine = db.get_engine()
+    with engine.connect():
+        pass
+    pool = engine.pool
+
+    pid = os.fork()
+    if pid == 0:  # pragma: no cover
+        os._exit(0 if engine.pool is not pool else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert engine.pool is pool
+
+
+def test_add_missing_columns():
+    from sqlalchemy import create_engine, inspect
+
+    from project_name.db import add_missing_columns
+
+    engine = create_engine("sqlite://")
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            "CREATE TABLE content (id INTEGER PRIMARY KEY, title VARCHAR)"
+        )
+    add_missing_columns(engine)
+    columns = {c["name"] for c in inspect(engine).get_columns("content")}
+    assert "updated_time" in columns
+
+
+def test_duplicate_slugs_are_renamed_before_the_index(tmp_path):
+    from sqlalchemy import create_engine, inspect
+    from sqlmodel import Session, select
+
+    from project_name.db import create_db_and_tables
+    from project_name.models.content import Content
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    create_db_and_tables(engine)
+    # as created before the slugs were unique
+    with engine.begin() as connection:
+        connection.exec_driver_sql("DROP INDEX ix_content_slug")
+    with Session(engine) as session:
+        for title in ["Same Title", "same title", "SAME TITLE", "other"]:
+            slug = title.lower().replace(" ", "-")
+            session.add(Content(title=title, slug=slug, text="t"))
+        session.commit()
+
+    assert create_db_and_tables(engine) == {"slugs": 2, "tags": 0}
+    with Session(engine) as session:
+        slugs = session.exec(select(Content.slug).order_by(Content.id))
+        assert slugs.all() == [
+            "same-title",
+            "same-title-2",
+            "same-title-3",
+            "other",
+        ]
+    indexes = inspect(engine).get_indexes("content")
+    assert any(
+        index["name"] == "ix_content_slug" and index["unique"]
+        for index in indexes
+    )
+
+
+def test_read_replica(api_client_authenticated, api_client, monkeypatch):
+    import os
+
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlmodel import Session, create_engine
+
+    from project_name import db
+    from project_name.models.content import Content
+
+    # a second database stands in for a replica that lags behind
+    replica_uri = f"sqlite:///{os.path.abspath('replica.db')}"
+    replica = create_engine(replica_uri)
+    db.create_db_and_tables(replica)
+    with Session(replica) as session:
+        session.add(Content(title="replica", slug="on-replica", text="r"))
+        session.commit()
+    replicas = [create_async_engine(get_async_uri(replica_uri))]
+    monkeypatch.setattr(db, "get_replica_engines", lambda: replicas)
+    db.recent_writers.clear()
+
+    assert api_client.get("/content/on-replica/").status_code == 200
+    assert api_client_authenticated.get("/content/").json()[0]["slug"] == (
+        "on-replica"
+    )
+
+    # after a write, reads of the same token go to the primary
+    response = api_client_authenticated.post(
+        "/content/", json={"title": "on primary", "text": "p"}
+    )
+    assert response.status_code == 200
+    content_id, slug = response.json()["id"], response.json()["slug"]
+    assert api_client_authenticated.get(f"/content/{slug}/").status_code == 200
+    assert (
+        api_client_authenticated.get("/content/on-replica/").status_code == 404
+    )
+    assert api_client.get(f"/content/{slug}/").status_code == 404
+
+    # new users can log in though they are not on the replica yet
+    response = api_client_authenticated.post(
+        "/user/", json={"username": "replicated", "password": "pass"}
+    )
+    assert response.status_code == 200
+    response = api_client.post(
+        "/token", data={"username": "replicated", "password": "pass"}
+    )
+    assert response.status_code == 200
+    # and read their profile, their token did not write yet
+    token = response.json()["access_token"]
+    response = api_client.get(
+        "/profile", headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 200
+    assert response.json()["username"] == "replicated"
+
+    response = api_client_authenticated.delete(f"/content/{content_id}/")
+    assert response.status_code == 200
+
+
+def test_recent_writers_are_shared(tmp_path):
+    from project_name.db import RecentWriters
+
+    path = str(tmp_path / "writers.db")
+    # two workers of the host, each with its own store
+    worker, other_worker = RecentWriters(path, ttl=5), RecentWriters(path)
+    worker.add("Bearer token")
+    assert "Bearer token" in other_worker
+    assert "Bearer other" not in other_worker
+
+    # the tokens are not written to the disk
+    for name in (path, f"{path}-wal"):
+        with open(name, "rb") as database:
+            assert b"Bearer" not in database.read()
+
+    worker.add("Bearer expired", now=time.time() - 10)
+    assert "Bearer expired" not in other_worker
+
+
+def test_server_timing(api_client):
+    response = api_client.get("/content/")
+    assert response.status_code == 200
+    timing = response.headers["Server-Timing"]
+    queries = int(re.search(r'desc="(\d+) queries"', timing).group(1))
+    assert queries >= 1
+
+    metrics = api_client.get("/metrics").text
+    labels = f'worker="{os.getpid()}",method="GET",route="/content/"'
+    assert f"db_queries_total{{{labels}}}" in metrics
+    assert "db_n_plus_one_total" in metrics
+
+
+def test_n_plus_one_detection(caplog):
+    from project_name.sqltrace import (
+        NPlusOneError,
+        QueryTraceMiddleware,
+        current_trace,
+    )
+
+    async def app(scope, receive, send):
+        for _ in range(3):
+            current_trace.get().record("SELECT * FROM user WHERE id = ?", 0)
+        current_trace.get().record("INSERT INTO user VALUES (?)", 0)
+
+    run_asgi(QueryTraceMiddleware(app, threshold=4, strict=True), "/n1")
+
+    run_asgi(QueryTraceMiddleware(app, threshold=3, strict=False), "/n1")
+    assert "Probable N+1 on GET /n1, ran 3 times" in caplog.text
+
+    with pytest.raises(NPlusOneError):
+        run_asgi(QueryTraceMiddleware(app, threshold=3, strict=True), "/n1")
@@ -8,3 +8,21 @@ def test_profile(api_client_authenticated):
 def test_profile_no_auth(api_client):
     response = api_client.get("/profile")
     assert response.status_code == 401
+
+
+def test_profile_conditional_get(api_client_authenticated):
+    response = api_client_authenticated.get("/profile")
+    etag = response.headers["etag"]
+
+    response = api_client_authenticated.get(
+        "/profile", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 304
+
+    api_client_authenticated.post(
+        "/content/", json={"title": "new profile content", "text": "t"}
+    )
+    response = api_client_authenticated.get(
+        "/profile", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 200
@@ -0,0 +1,62 @@
+from project_name import ratelimit
+from project_name.cli import create_user
+from project_name.ratelimit import RateLimiter
+
+
+def test_sliding_window(tmp_path):
+    limiter = RateLimiter(str(tmp_path / "limits.db"), window=60)
+    assert limiter.hit({"a": 2}, now=600) == 0
+    assert limiter.hit({"a": 2}, now=610) == 0
+    assert limiter.hit({"a": 2}, now=619) == 41
+    # other keys have their own counters
+    assert limiter.hit({"b": 2}, now=619) == 0
+    # the previous window counts for the part still in the sliding one
+    assert limiter.hit({"a": 2}, now=690) == 0
+    assert limiter.hit({"a": 2}, now=691) == 0
+    assert limiter.hit({"a": 2}, now=692) == 28
+    assert limiter.hit({"a": 2}, now=750) == 0
+
+
+def test_rejected_requests_are_not_counted(tmp_path):
+    limiter = RateLimiter(str(tmp_path / "limits.db"), window=60)
+    assert limiter.hit({"ip": 1, "user": 5}, now=600) == 0
+    assert limiter.hit({"ip": 1, "user": 5}, now=601)
+    assert limiter.hit({"user": 2}, now=602) == 0
+    assert limiter.hit({"user": 2}, now=603)
+
+
+def test_limiters_share_the_store(tmp_path):
+    path = str(tmp_path / "limits.db")
+    assert RateLimiter(path).hit({"a": 1}, now=600) == 0
+    assert RateLimiter(path).hit({"a": 1}, now=601)
+
+
+def test_login_is_limited_before_hashing(api_client, monkeypatch):
+    create_user("ratelimited", "password")
+    monkeypatch.setattr(ratelimit, "RATE_LIMIT_PER_USERNAME", 3)
+    hashed = []
+    monkeypatch.setattr(
+        "project_name.security.pwd_context.verify",
+        lambda *args: hashed.append(args) or False,
+    )
+    statuses = [
+        api_client.post(
+            "/token", data={"username": "ratelimited", "password": "wrong"}
+        ).status_code
+        for _ in range(5)
+    ]
+    assert statuses == [401, 401, 401, 429, 429]
+    assert len(hashed) == 3
+
+    response = api_client.post(
+        "/token", data={"username": "ratelimited", "password": "wrong"}
+    )
+    assert int(response.headers["Retry-After"]) > 0
+
+
+def test_refresh_token_is_limited_per_ip(api_client, monkeypatch):
+    monkeypatch.setattr(ratelimit, "RATE_LIMIT_PER_IP", 0)
+    response = api_client.post(
+        "/refresh_token", json={"refresh_token": "invalid"}
+    )
+    assert response.status_code == 429
@@ -1,3 +1,8 @@
+import asyncio
+
+from project_name.pagination import encode_cursor
+
+
 def test_user_list(api_client_authenticated):
     response = api_client_authenticated.get("/user/")
     assert response.status_code == 200
@@ -286,3 +291,234 @@ def test_stale_token(api_client_authenticated):
     assert response.status_code == 401
 
     del api_client_authenticated.headers["Authorization"]
+
+
+def test_user_cache_invalidated_on_password_change(api_client_authenticated):
+    from project_name.security import user_cache
+
+    response = api_client_authenticated.post(
+        "/user/",
+        json={"username": "cached", "password": "old", "superuser": False},
+    )
+    assert response.status_code == 200
+    user_id = response.json()["id"]
+
+    login = {"username": "cached", "password": "old"}
+    headers = {"Content-Type": "application/x-www-form-urlencoded"}
+    response = api_client_authenticated.post(
+        "/token", data=login, headers=headers
+    )
+    assert response.status_code == 200
+    token = response.json()["access_token"]
+    auth = {"Authorization": f"Bearer {token}"}
+    api_client_authenticated.get("/profile", headers=auth)
+    assert user_cache.get("cached") is not None
+
+    hits = user_cache.hits
+    api_client_authenticated.get("/profile", headers=auth)
+    assert user_cache.hits == hits + 1
+    stale = user_cache.get("cached")
+
+    response = api_client_authenticated.patch(
+        f"/user/{user_id}/password/",
+        json={"password": "new", "password_confirm": "new"},
+    )
+    assert response.status_code == 200
+    assert user_cache.get("cached") is None
+
+    # as cached by another worker, login reads the database anyway
+    user_cache.set("cached", stale)
+    response = api_client_authenticated.post(
+        "/token", data=login, headers=headers
+    )
+    assert response.status_code == 401
+    response = api_client_authenticated.post(
+        "/token", data={**login, "password": "new"}, headers=headers
+    )
+    assert response.status_code == 200
+
+    response = api_client_authenticated.delete(f"/user/{user_id}/")
+    assert response.status_code == 200
+    assert user_cache.get("cached") is None
+
+
+def test_cached_user_is_not_shared(api_client_authenticated):
+    from project_name.security import get_user
+
+    async def lookup():
+        first = await get_user("admin")
+        first.superuser = False
+        return first, await get_user("admin")
+
+    first, second = asyncio.run(lookup())
+    assert first is not second
+    assert second.superuser
+
+
+def test_login_hashes_off_the_event_loop(api_client):
+    from project_name.security import password_hasher
+
+    completed = password_hasher.completed
+    response = api_client.post(
+        "/token",
+        data={"username": "admin", "password": "admin"},
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+    )
+    assert response.status_code == 200
+    assert password_hasher.completed == completed + 1
+
+    stats = api_client.get("/health").json()["password_hasher"]
+    assert stats["pending"] == 0
+    assert stats["completed"] >= 1
+
+
+def test_user_list_pagination(api_client_authenticated):
+    response = api_client_authenticated.get("/user/", params={"limit": 1})
+    assert response.status_code == 200
+    assert len(response.json()) == 1
+    cursor = response.headers["x-next-cursor"]
+
+    response = api_client_authenticated.get(
+        "/user/", params={"limit": 1, "cursor": cursor}
+    )
+    assert response.status_code == 200
+    assert response.json()[0]["id"] > 1
+
+
+def test_user_list_queries_dont_grow_with_users(
+    api_client_authenticated, queries
+):
+    for i in range(4):
+        response = api_client_authenticated.post(
+            "/user/", json={"username": f"many{i}", "password": "many"}
+        )
+        assert response.status_code == 200
+        token = api_client_authenticated.post(
+            "/token", data={"username": f"many{i}", "password": "many"}
+        ).json()["access_token"]
+        api_client_authenticated.post(
+            "/content/",
+            json={"title": f"many {i}", "text": "many", "tags": ["many"]},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+
+    # start at the users above, which all have contents
+    first = api_client_authenticated.get("/user/many0/").json()["id"]
+    counts = []
+    for limit in (1, 4):
+        queries.clear()
+        response = api_client_authenticated.get(
+            "/user/",
+            params={"limit": limit, "cursor": encode_cursor(first - 1)},
+        )
+        assert len(response.json()) == limit
+        counts.append(len(queries))
+    assert counts[0] == counts[1]
+
+
+def test_user_without_contents(api_client_authenticated):
+    response = api_client_authenticated.get(
+        "/user/", params={"include_contents": False}
+    )
+    assert response.status_code == 200
+    assert all(user["contents"] is None for user in response.json())
+
+    response = api_client_authenticated.get(
+        "/profile", params={"include_contents": False}
+    )
+    assert response.status_code == 200
+    assert response.json()["contents"] is None
+
+
+def test_user_list_fast_json(api_client_authenticated, monkeypatch):
+    from project_name import responses
+
+    for include_contents in (True, False):
+        params = {"include_contents": include_contents}
+        monkeypatch.setattr(responses, "FAST_JSON", False)
+        response = api_client_authenticated.get("/user/", params=params)
+        monkeypatch.setattr(responses, "FAST_JSON", True)
+        fast_response = api_client_authenticated.get("/user/", params=params)
+        assert fast_response.json() == response.json()
+
+
+def test_auth_is_resolved_once_per_request(
+    api_client_authenticated, queries, monkeypatch
+):
+    from project_name import security
+
+    decodes = []
+    decode = security.jwt.decode
+
+    def counting_decode(*args, **kwargs):
+        decodes.append(args)
+        return decode(*args, **kwargs)
+
+    monkeypatch.setattr(security.jwt, "decode", counting_decode)
+    client = api_client_authenticated
+    created = client.post(
+        "/user/", json={"username": "auth_once", "password": "auth_once"}
+    ).json()
+    content = client.post(
+        "/content/", json={"title": "auth once", "text": "t"}
+    ).json()
+    bulk = client.post(
+        "/content/bulk", json=[{"title": "auth once bulk", "text": "t"}]
+    ).json()
+    admin = client.get("/user/admin/").json()
+
+    requests = [
+        ("post", "/content/", {"title": "auth once 2", "text": "t"}),
+        ("patch", f"/content/{content['id']}/", {"text": "patched"}),
+        ("post", "/content/bulk", [{"title": "auth once 3", "text": "t"}]),
+        ("patch", "/content/bulk", [{"id": bulk[0]["id"], "text": "p"}]),
+        ("delete", "/content/bulk", [bulk[0]["id"]]),
+        ("delete", f"/content/{content['id']}/", None),
+        (
+            "patch",
+            f"/user/{admin['id']}/password/",
+            {"password": "admin", "password_confirm": "admin"},
+        ),
+        ("delete", f"/user/{created['id']}/", None),
+    ]
+    for method, url, body in requests:
+        security.user_cache.clear()
+        decodes.clear()
+        queries.clear()
+        response = client.request(method, url, json=body)
+        assert response.status_code == 200, (url, response.text)
+        user_queries = [
+            statement
+            for statement, _ in queries
+            if "WHERE user.username =" in statement
+        ]
+        assert len(decodes) == 1, (method, url)
+        assert len(user_queries) == 1, (method, url)
+
+
+def test_user_sparse_fields(api_client_authenticated, queries):
+    client = api_client_authenticated
+    client.post("/content/", json={"title": "user fields", "text": "t"})
+
+    queries.clear()
+    response = client.get(
+        "/user/admin/", params={"fields": "username,contents.title"}
+    )
+    assert response.status_code == 200
+    user = response.json()
+    assert set(user) == {"username", "contents"}
+    assert {"title": "user fields"} in user["contents"]
+    statements = [statement for statement, _ in queries]
+    assert not any("user.password" in s for s in statements)
+    assert not any("content.text" in s for s in statements)
+
+    response = client.get("/user/", params={"fields": "id,username"})
+    assert all(set(user) == {"id", "username"} for user in response.json())
+
+    response = client.get("/profile", params={"fields": "username"})
+    assert response.json() == {"username": "admin"}
+    response = client.get("/profile", params={"fields": "contents.slug"})
+    assert {"slug": "user-fields"} in response.json()["contents"]
+
+    response = client.get("/user/", params={"fields": "contents.nothing"})
+    assert response.status_code == 400
@@ -0,0 +1,27 @@
+import asyncio
+
+
+def run_asgi(app, path="/", headers=()):
+    """Send a GET request to the ASGI `app`, returns the messages sent."""
+    messages = []
+    sent = asyncio.Event()
+
+    async def receive():
+        # the client stays connected until the response is sent
+        await sent.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        messages.append(message)
+        if not message.get("more_body", True):
+            sent.set()
+
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": path,
+        "query_string": b"",
+        "headers": list(headers),
+    }
+    asyncio.run(app(scope, receive, send))
+    return messages